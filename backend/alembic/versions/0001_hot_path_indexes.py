@@ -0,0 +1,53 @@
+"""hot path indexes for requests, rents and comments
+
+Revision ID: 0001_hot_path_indexes
+Revises: 
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001_hot_path_indexes'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+PENDING = sa.text("status = 'pending'")
+OPEN = sa.text("status IN ('pending', 'return_requested')")
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index("ix_requests_user_book_status", "requests", ["user_id", "book_id", "status"], if_not_exists=True)
+    op.create_index("ix_requests_book_id", "requests", ["book_id"], if_not_exists=True)
+    op.create_index(
+        "ix_requests_pending_book", "requests", ["book_id"],
+        postgresql_where=PENDING, sqlite_where=PENDING, if_not_exists=True,
+    )
+    op.create_index(
+        "ix_requests_open_created", "requests", ["created_at", "id"],
+        postgresql_where=OPEN, sqlite_where=OPEN, if_not_exists=True,
+    )
+    op.create_index("ix_rents_user_book", "rents", ["user_id", "book_id"], if_not_exists=True)
+    op.create_index("ix_rents_book_id", "rents", ["book_id"], if_not_exists=True)
+    op.create_index(
+        "ix_comments_book_created", "comments", ["book_id", sa.text("created_at DESC")], if_not_exists=True
+    )
+    op.create_index("ix_comments_user_id", "comments", ["user_id"], if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_comments_user_id", table_name="comments", if_exists=True)
+    op.drop_index("ix_comments_book_created", table_name="comments", if_exists=True)
+    op.drop_index("ix_rents_book_id", table_name="rents", if_exists=True)
+    op.drop_index("ix_rents_user_book", table_name="rents", if_exists=True)
+    op.drop_index("ix_requests_open_created", table_name="requests", if_exists=True)
+    op.drop_index("ix_requests_pending_book", table_name="requests", if_exists=True)
+    op.drop_index("ix_requests_book_id", table_name="requests", if_exists=True)
+    op.drop_index("ix_requests_user_book_status", table_name="requests", if_exists=True)
@@ -0,0 +1,49 @@
+"""materialized rent expiry
+
+Revision ID: 0001a_rent_expires_at
+Revises: 0001_hot_path_indexes
+Create Date: 2026-10-18 12:30:00.000000
+
+"""
+from datetime import datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001a_rent_expires_at'
+down_revision: Union[str, None] = '0001_hot_path_indexes'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# models.RENT_DURATION на момент миграции
+RENT_HOURS = 48
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    columns = {c["name"] for c in sa.inspect(bind).get_columns("rents")}
+    if "expires_at" not in columns:
+        op.add_column("rents", sa.Column("expires_at", sa.DateTime(), nullable=True))
+    # аренда создаётся в момент одобрения, поэтому rented_at и есть время одобрения
+    if bind.dialect.name == "postgresql":
+        expires = f"coalesce(rented_at, :now) + interval '{RENT_HOURS} hours'"
+    else:
+        expires = f"datetime(coalesce(rented_at, :now), '+{RENT_HOURS} hours')"
+    op.execute(
+        sa.text(f"UPDATE rents SET expires_at = {expires} WHERE expires_at IS NULL")
+        .bindparams(now=datetime.utcnow())
+    )
+    with op.batch_alter_table("rents") as batch_op:
+        batch_op.alter_column("expires_at", existing_type=sa.DateTime(), nullable=False)
+    op.create_index("ix_rents_expires_at", "rents", ["expires_at"], if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_rents_expires_at", table_name="rents", if_exists=True)
+    with op.batch_alter_table("rents") as batch_op:
+        batch_op.drop_column("expires_at")
@@ -0,0 +1,63 @@
+"""book storage and ingest columns
+
+Revision ID: 0001b_book_storage_columns
+Revises: 0001a_rent_expires_at
+Create Date: 2026-10-18 12:45:00.000000
+
+"""
+import os
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import TSVECTOR
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001b_book_storage_columns'
+down_revision: Union[str, None] = '0001a_rent_expires_at'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COLUMNS = [
+    ("pdf_sha256", sa.String()),
+    ("pdf_size", sa.Integer()),
+    ("ingest_status", sa.String()),
+    ("ingest_error", sa.String()),
+    ("page_count", sa.Integer()),
+    ("thumbnail_path", sa.String()),
+    ("content_text", sa.Text()),
+    ("search_vector", TSVECTOR().with_variant(sa.Text(), "sqlite")),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    columns = {c["name"] for c in sa.inspect(bind).get_columns("books")}
+    for name, type_ in COLUMNS:
+        if name not in columns:
+            op.add_column("books", sa.Column(name, type_))
+    op.create_index("ix_books_pdf_sha256", "books", ["pdf_sha256"], if_not_exists=True)
+    op.create_index("ix_books_ingest_status", "books", ["ingest_status"], if_not_exists=True)
+    # старые книги не отдаём фоновой обработке: иначе воркер при старте возьмётся за всю библиотеку сразу
+    op.execute(sa.text(
+        "UPDATE books SET ingest_status = 'legacy' WHERE ingest_status IS NULL AND pdf_path IS NOT NULL"
+    ))
+    # размер берём из stat, sha256 не считаем: пришлось бы перечитать все файлы
+    rows = bind.execute(sa.text("SELECT id, pdf_path FROM books WHERE pdf_size IS NULL AND pdf_path IS NOT NULL")).all()
+    for book_id, pdf_path in rows:
+        if os.path.isfile(pdf_path):
+            bind.execute(
+                sa.text("UPDATE books SET pdf_size = :size WHERE id = :id"),
+                {"size": os.path.getsize(pdf_path), "id": book_id},
+            )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_books_ingest_status", table_name="books", if_exists=True)
+    op.drop_index("ix_books_pdf_sha256", table_name="books", if_exists=True)
+    with op.batch_alter_table("books") as batch_op:
+        for name, _ in reversed(COLUMNS):
+            batch_op.drop_column(name)
@@ -0,0 +1,47 @@
+"""one active rent per book
+
+Revision ID: 0002_one_rent_per_book
+Revises: 0001b_book_storage_columns
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from datetime import datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002_one_rent_per_book'
+down_revision: Union[str, None] = '0001b_book_storage_columns'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # expires_at хранится в наивном UTC, CURRENT_TIMESTAMP зависит от часового пояса базы
+    now = datetime.utcnow()
+    # аренда уходит, если просрочена или у книги есть более новая живая аренда
+    stale = (
+        "({r}.expires_at <= :now OR EXISTS (SELECT 1 FROM rents newer WHERE newer.book_id = {r}.book_id "
+        "AND newer.id > {r}.id AND newer.expires_at > :now))"
+    )
+    # заявки снятых аренд закрываем так же, как release_expired_rents, если у пары не остаётся живой аренды
+    op.execute(sa.text(
+        "UPDATE requests SET status = 'expired' WHERE status = 'approved' "
+        "AND EXISTS (SELECT 1 FROM rents r WHERE r.user_id = requests.user_id AND r.book_id = requests.book_id "
+        f"AND {stale.format(r='r')}) "
+        "AND NOT EXISTS (SELECT 1 FROM rents k WHERE k.user_id = requests.user_id AND k.book_id = requests.book_id "
+        f"AND NOT {stale.format(r='k')})"
+    ).bindparams(now=now))
+    op.execute(sa.text(f"DELETE FROM rents WHERE {stale.format(r='rents')}").bindparams(now=now))
+    op.drop_index("ix_rents_book_id", table_name="rents", if_exists=True)
+    op.create_index("uq_rents_book_id", "rents", ["book_id"], unique=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("uq_rents_book_id", table_name="rents", if_exists=True)
+    op.create_index("ix_rents_book_id", "rents", ["book_id"], if_not_exists=True)
@@ -0,0 +1,44 @@
+"""book rating aggregates
+
+Revision ID: 0003_book_rating_aggregates
+Revises: 0002_one_rent_per_book
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003_book_rating_aggregates'
+down_revision: Union[str, None] = '0002_one_rent_per_book'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    columns = {c["name"] for c in sa.inspect(op.get_bind()).get_columns("books")}
+    for name in ("rating_count", "rating_sum"):
+        if name not in columns:
+            op.add_column("books", sa.Column(name, sa.Integer(), server_default="0", nullable=False))
+    op.execute(sa.text(
+        "UPDATE books SET "
+        "rating_count = (SELECT count(rating) FROM comments WHERE comments.book_id = books.id), "
+        "rating_sum = (SELECT coalesce(sum(rating), 0) FROM comments WHERE comments.book_id = books.id)"
+    ))
+    op.drop_index("ix_comments_book_created", table_name="comments", if_exists=True)
+    op.create_index(
+        "ix_comments_book_created", "comments", ["book_id", sa.text("created_at DESC"), sa.text("id DESC")]
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_comments_book_created", table_name="comments", if_exists=True)
+    op.create_index("ix_comments_book_created", "comments", ["book_id", sa.text("created_at DESC")])
+    with op.batch_alter_table("books") as batch_op:
+        batch_op.drop_column("rating_sum")
+        batch_op.drop_column("rating_count")
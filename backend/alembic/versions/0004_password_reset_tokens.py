@@ -0,0 +1,38 @@
+"""password reset tokens
+
+Revision ID: 0004_password_reset_tokens
+Revises: 0003_book_rating_aggregates
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004_password_reset_tokens'
+down_revision: Union[str, None] = '0003_book_rating_aggregates'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "password_reset_tokens",
+        sa.Column("token_hash", sa.String(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("expires_at", sa.DateTime(), nullable=False),
+        if_not_exists=True,
+    )
+    op.create_index(
+        "ix_password_reset_tokens_expires_at", "password_reset_tokens", ["expires_at"], if_not_exists=True
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_password_reset_tokens_expires_at", table_name="password_reset_tokens", if_exists=True)
+    op.drop_table("password_reset_tokens", if_exists=True)
@@ -0,0 +1,50 @@
+"""chat messages
+
+Revision ID: 0005_chat_messages
+Revises: 0004_password_reset_tokens
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005_chat_messages'
+down_revision: Union[str, None] = '0004_password_reset_tokens'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "chat_messages",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("conversation", sa.String(), nullable=False),
+        sa.Column("sender", sa.String(), nullable=False),
+        sa.Column("recipient", sa.String(), nullable=False),
+        sa.Column("type", sa.String(), nullable=False),
+        sa.Column("payload", sa.Text(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("delivered_at", sa.DateTime()),
+        if_not_exists=True,
+    )
+    op.create_index(
+        "ix_chat_messages_conversation_id", "chat_messages", ["conversation", "id"], if_not_exists=True
+    )
+    op.create_index(
+        "ix_chat_messages_undelivered", "chat_messages", ["recipient", "id"],
+        postgresql_where=sa.text("delivered_at IS NULL"),
+        sqlite_where=sa.text("delivered_at IS NULL"),
+        if_not_exists=True,
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_chat_messages_undelivered", table_name="chat_messages", if_exists=True)
+    op.drop_index("ix_chat_messages_conversation_id", table_name="chat_messages", if_exists=True)
+    op.drop_table("chat_messages", if_exists=True)
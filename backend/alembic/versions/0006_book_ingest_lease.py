@@ -0,0 +1,31 @@
+"""book ingest lease
+
+Revision ID: 0006_book_ingest_lease
+Revises: 0005_chat_messages
+Create Date: 2026-10-18 19:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0006_book_ingest_lease'
+down_revision: Union[str, None] = '0005_chat_messages'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    columns = {c["name"] for c in sa.inspect(op.get_bind()).get_columns("books")}
+    if "ingest_claimed_at" not in columns:
+        op.add_column("books", sa.Column("ingest_claimed_at", sa.DateTime()))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table("books") as batch_op:
+        batch_op.drop_column("ingest_claimed_at")
@@ -0,0 +1,38 @@
+"""book import manifest offset
+
+Revision ID: 0007_book_import_offset
+Revises: 0006_book_ingest_lease
+Create Date: 2026-10-18 20:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0007_book_import_offset'
+down_revision: Union[str, None] = '0006_book_ingest_lease'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # book_imports создаёт init_db; в базе, где таблицы ещё нет, она появится сразу с колонкой
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table("book_imports"):
+        return
+    if "manifest_offset" not in {c["name"] for c in inspector.get_columns("book_imports")}:
+        op.add_column("book_imports", sa.Column("manifest_offset", sa.Integer()))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    inspector = sa.inspect(op.get_bind())
+    if inspector.has_table("book_imports") and "manifest_offset" in {
+        c["name"] for c in inspector.get_columns("book_imports")
+    }:
+        with op.batch_alter_table("book_imports") as batch_op:
+            batch_op.drop_column("manifest_offset")
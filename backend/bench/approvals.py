@@ -0,0 +1,95 @@
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.scratch import scratch_database
+
+scratch_database()
+
+import httpx
+from sqlalchemy import func, insert, select
+from auth import create_access_token
+from database import AsyncSessionLocal, engine, init_db
+from main import app
+from models import Book, Rent, Request, User
+
+# пропускная способность параллельных одобрений заявок на одни и те же книги; нарушения тоже печатаются,
+# но блокировки проверяет tests/test_approvals.py на postgres - SQLite игнорирует FOR UPDATE
+
+
+async def seed(books: int, readers: int):
+    async with AsyncSessionLocal() as db:
+        prefix = f"bench{int(time.time())}"
+        await db.execute(insert(User), [
+            {"username": f"{prefix}_lib", "password": "-", "role": "librarian", "email": f"{prefix}_lib@example.com"},
+            *[
+                {"username": f"{prefix}_{i}", "password": "-", "role": "reader", "email": f"{prefix}_{i}@example.com"}
+                for i in range(readers)
+            ],
+        ])
+        user_ids = (await db.execute(
+            select(User.id).where(User.username.like(f"{prefix}\\_%", escape="\\"), User.role == "reader")
+        )).scalars().all()
+        book_ids = (await db.execute(
+            insert(Book).returning(Book.id),
+            [{"title": f"{prefix} книга {i}", "author": "-", "genre": "-", "publisher": "-", "description": "-"} for i in range(books)],
+        )).scalars().all()
+        request_ids = (await db.execute(
+            insert(Request).returning(Request.id),
+            [{"user_id": u, "book_id": b, "status": "pending"} for b in book_ids for u in user_ids],
+        )).scalars().all()
+        await db.commit()
+    return f"{prefix}_lib", book_ids, request_ids
+
+
+async def check(book_ids):
+    async with AsyncSessionLocal() as db:
+        rents = dict((await db.execute(
+            select(Rent.book_id, func.count()).where(Rent.book_id.in_(book_ids)).group_by(Rent.book_id)
+        )).all())
+        approved = dict((await db.execute(
+            select(Request.book_id, func.count())
+            .where(Request.book_id.in_(book_ids), Request.status == "approved")
+            .group_by(Request.book_id)
+        )).all())
+    return [b for b in book_ids if rents.get(b, 0) > 1 or approved.get(b, 0) > 1 or rents.get(b, 0) != approved.get(b, 0)]
+
+
+async def main(books: int, readers: int, concurrency: int):
+    await init_db()
+    librarian, book_ids, request_ids = await seed(books, readers)
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': librarian})}"}
+    semaphore = asyncio.Semaphore(concurrency)
+    statuses = {}
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        async def approve(request_id):
+            async with semaphore:
+                r = await client.post("/process_request", json={"request_id": request_id, "approve": True}, headers=headers)
+                statuses[r.status_code] = statuses.get(r.status_code, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(approve(i) for i in request_ids))
+        elapsed = time.perf_counter() - started
+
+    violations = await check(book_ids)
+    await engine.dispose()
+    print(f"заявок: {len(request_ids)}, книг: {len(book_ids)}, параллельно: {concurrency}")
+    print(f"время: {elapsed:.2f} с, {len(request_ids) / elapsed:.0f} заявок/с")
+    print("ответы:", ", ".join(f"{code}: {count}" for code, count in sorted(statuses.items())))
+    if violations:
+        print("КНИГИ ВЫДАНЫ НЕСКОЛЬКО РАЗ:", violations)
+    return bool(violations)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Параллельные одобрения заявок на одни и те же книги")
+    parser.add_argument("--books", type=int, default=20)
+    parser.add_argument("--readers", type=int, default=25)
+    parser.add_argument("--concurrency", type=int, default=100)
+    args = parser.parse_args()
+    sys.exit(1 if asyncio.run(main(args.books, args.readers, args.concurrency)) else 0)
@@ -0,0 +1,114 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chat_manager import UserChatManager
+
+# рассылка по тысячам сокетов, часть из которых медленные или уже мёртвые
+
+
+class FakeSocket:
+    def __init__(self, delay: float = 0.0, dead: bool = False):
+        self.delay = delay
+        self.dead = dead
+        self.received = 0
+        self.closed = False
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        if self.dead:
+            raise ConnectionResetError("клиент отключился")
+        await asyncio.sleep(self.delay)
+        if '"book_available"' in text:
+            self.received += 1
+
+    async def send_json(self, data):
+        await self.send_text(json.dumps(data, ensure_ascii=False))
+
+    async def close(self, code: int = 1000):
+        self.closed = True
+
+
+def make_sockets(clients: int, slow: int, dead: int, slow_delay: float):
+    sockets = []
+    for i in range(clients):
+        if i < slow:
+            sockets.append(FakeSocket(delay=slow_delay))
+        elif i < slow + dead:
+            sockets.append(FakeSocket(dead=True))
+        else:
+            sockets.append(FakeSocket())
+    return sockets
+
+
+async def sequential(sockets, broadcasts: int):
+    # прежняя схема: await send_json по очереди для каждого сокета
+    started = time.perf_counter()
+    for i in range(broadcasts):
+        for ws in sockets:
+            try:
+                await ws.send_json({"type": "book_available", "book_id": i, "book_title": "Книга"})
+            except ConnectionResetError:
+                pass
+    return time.perf_counter() - started
+
+
+async def queued(sockets, broadcasts: int, interval: float, queue_size: int, send_timeout: float):
+    manager = UserChatManager(queue_size=queue_size, send_timeout=send_timeout)
+    for i, ws in enumerate(sockets):
+        await manager.connect(f"user{i}", ws)
+    fast = [ws for ws in sockets if not ws.delay and not ws.dead]
+    started = time.perf_counter()
+    for i in range(broadcasts):
+        await manager.broadcast_book_available(i, "Книга")
+        await asyncio.sleep(interval)
+    enqueued = time.perf_counter() - started
+    # быстрый клиент тоже мог быть отключён, если рассылки идут чаще, чем он успевает их забирать
+    while any(ws.received < broadcasts and not ws.closed for ws in fast):
+        await asyncio.sleep(0.001)
+    delivered = time.perf_counter() - started
+    fast_evicted = sum(ws.closed for ws in fast)
+    for conn in list(manager.active_connections.values()):
+        manager.disconnect(conn.username, conn.websocket)
+    await asyncio.gather(*manager.closing, return_exceptions=True)
+    return enqueued, delivered, manager.evicted, fast_evicted
+
+
+async def main(clients, slow, dead, slow_delay, broadcasts, interval, queue_size, send_timeout, skip_sequential):
+    print(f"клиентов: {clients} (медленных {slow} по {slow_delay * 1000:.0f} мс, мёртвых {dead}), рассылок: {broadcasts}")
+    enqueued, delivered, evicted, fast_evicted = await queued(
+        make_sockets(clients, slow, dead, slow_delay), broadcasts, interval, queue_size, send_timeout
+    )
+    print(
+        f"очереди на соединение: рассылки поставлены за {enqueued * 1000:.1f} мс, "
+        f"быстрые клиенты получили всё за {delivered * 1000:.1f} мс, "
+        f"отключено: {evicted} (из них быстрых: {fast_evicted})"
+    )
+    if not skip_sequential:
+        elapsed = await sequential(make_sockets(clients, slow, dead, slow_delay), broadcasts)
+        print(f"последовательная отправка: {elapsed * 1000:.1f} мс")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Рассылка UserChatManager по тысячам сокетов")
+    parser.add_argument("--clients", type=int, default=5000)
+    parser.add_argument("--slow", type=int, default=20)
+    parser.add_argument("--dead", type=int, default=50)
+    parser.add_argument("--slow-delay", type=float, default=0.05)
+    parser.add_argument("--broadcasts", type=int, default=20)
+    parser.add_argument("--interval", type=float, default=0.01, help="пауза между рассылками, с")
+    parser.add_argument("--queue-size", type=int, default=8)
+    parser.add_argument("--send-timeout", type=float, default=1.0)
+    parser.add_argument("--skip-sequential", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(main(
+        args.clients, args.slow, args.dead, args.slow_delay, args.broadcasts, args.interval,
+        args.queue_size, args.send_timeout, args.skip_sequential,
+    ))
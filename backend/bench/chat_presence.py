@@ -0,0 +1,100 @@
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chat_manager import UserChatManager
+
+# трафик присутствия в час пик: постоянные подключения и отключения при тысячах онлайн
+
+
+class CountingSocket:
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        self.messages += 1
+        self.bytes += len(text)
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+class FullListManager(UserChatManager):
+    # прежняя схема: полный список всем при каждом подключении и отключении
+    broadcasting = False
+
+    def presence_changed(self):
+        # отключение переполненного клиента внутри рассылки не запускает новую рассылку
+        if self.broadcasting:
+            return
+        self.broadcasting = True
+        try:
+            self.broadcast({"type": "users", "users": self.online_users()})
+        finally:
+            self.broadcasting = False
+
+
+async def churn(manager, sockets, online: int, events: int, rate: float, seed: int):
+    rng = random.Random(seed)
+    # стартовые подключения не считаем и не рассылаем
+    manager.presence_changed = lambda: None
+    for i in range(online):
+        await manager.connect(f"user{i}", sockets.setdefault(f"user{i}", CountingSocket()))
+    del manager.presence_changed
+    manager.announced = set(manager.active_connections)
+    await asyncio.sleep(manager.presence_debounce * 2)
+    for ws in sockets.values():
+        ws.messages = ws.bytes = 0
+    started = time.perf_counter()
+    offline = []
+    for _ in range(events):
+        if offline and rng.random() < 0.5:
+            username = offline.pop(rng.randrange(len(offline)))
+            await manager.connect(username, sockets[username])
+        else:
+            username = rng.choice(list(manager.active_connections))
+            manager.disconnect(username)
+            offline.append(username)
+        await asyncio.sleep(1 / rate)
+    await asyncio.sleep(manager.presence_debounce * 2)
+    elapsed = time.perf_counter() - started
+    tasks = [conn.task for conn in manager.active_connections.values()]
+    for conn in list(manager.active_connections.values()):
+        manager.disconnect(conn.username, conn.websocket)
+    if manager.presence_task:
+        manager.presence_task.cancel()
+    await asyncio.gather(*tasks, *manager.closing, return_exceptions=True)
+    return elapsed, sum(ws.messages for ws in sockets.values()), sum(ws.bytes for ws in sockets.values())
+
+
+async def main(online, events, rate, debounce, seed):
+    print(f"онлайн: {online}, событий: {events} ({rate:.0f} в секунду), окно: {debounce * 1000:.0f} мс")
+    for name, manager in (
+        ("полный список", FullListManager(presence_debounce=debounce)),
+        ("изменения", UserChatManager(presence_debounce=debounce)),
+    ):
+        elapsed, messages, size = await churn(manager, {}, online, events, rate, seed)
+        print(
+            f"{name}: сообщений {messages}, {size / 1024 / 1024:.1f} МБ за {elapsed:.2f} с, "
+            f"отключено переполненных: {manager.evicted}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Рассылка присутствия в чате при подключениях и отключениях")
+    parser.add_argument("--online", type=int, default=1000)
+    parser.add_argument("--events", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=100, help="подключений и отключений в секунду")
+    parser.add_argument("--debounce", type=float, default=0.25)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    asyncio.run(main(args.online, args.events, args.rate, args.debounce, args.seed))
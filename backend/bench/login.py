@@ -0,0 +1,97 @@
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.scratch import scratch_database
+
+scratch_database()
+
+import httpx
+from sqlalchemy import insert
+from auth import password_hasher, pwd_context
+from database import AsyncSessionLocal, engine, init_db
+from main import app
+from models import User
+
+# пропускная способность /token при разной стоимости bcrypt и задержка остальных запросов во время шторма логинов
+
+PASSWORD = "Bench123!"
+
+
+async def seed(rounds: int, users: int):
+    prefix = f"b{rounds}_{int(time.time()) % 100000}"
+    hashed = pwd_context.handler("bcrypt").using(rounds=rounds).hash(PASSWORD)
+    async with AsyncSessionLocal() as db:
+        await db.execute(insert(User), [
+            {"username": f"{prefix}_{i}", "password": hashed, "role": "reader", "email": f"{prefix}_{i}@example.com"}
+            for i in range(users)
+        ])
+        await db.commit()
+    return [f"{prefix}_{i}" for i in range(users)]
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def run(client, usernames, logins: int, concurrency: int):
+    statuses = {}
+    probe_latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    done = asyncio.Event()
+
+    async def login(i):
+        async with semaphore:
+            r = await client.post("/token", data={"username": usernames[i % len(usernames)], "password": PASSWORD})
+            statuses[r.status_code] = statuses.get(r.status_code, 0) + 1
+
+    async def probe():
+        # лёгкий запрос, который не должен ждать bcrypt
+        while not done.is_set():
+            started = time.perf_counter()
+            await client.get("/books/facets")
+            probe_latencies.append(time.perf_counter() - started)
+            await asyncio.sleep(0.01)
+
+    prober = asyncio.create_task(probe())
+    started = time.perf_counter()
+    await asyncio.gather(*(login(i) for i in range(logins)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await prober
+    return elapsed, statuses, probe_latencies
+
+
+async def main(rounds_list, logins: int, concurrency: int):
+    await init_db()
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        print(f"потоков bcrypt: {password_hasher.workers}, лимит очереди: {password_hasher.max_pending}")
+        for rounds in rounds_list:
+            usernames = await seed(rounds, min(logins, 50))
+            elapsed, statuses, probes = await run(client, usernames, logins, concurrency)
+            ok = statuses.get(200, 0)
+            print(
+                f"rounds={rounds}: {logins} логинов за {elapsed:.2f} с, {ok / elapsed:.1f} успешных/с; "
+                f"ответы {dict(sorted(statuses.items()))}; "
+                f"соседний запрос p50={statistics.median(probes) * 1000 if probes else 0:.1f} мс "
+                f"p95={percentile(probes, 0.95) * 1000:.1f} мс"
+            )
+    password_hasher.shutdown()
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Нагрузочный тест входа: bcrypt в отдельном пуле потоков")
+    parser.add_argument("--rounds", type=int, nargs="+", default=[10, 11, 12])
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.rounds, args.logins, args.concurrency))
@@ -0,0 +1,43 @@
+import asyncio
+import atexit
+import os
+import tempfile
+import uuid
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+
+# бенчи сеют тысячи строк, поэтому пишут не в DATABASE_URL, а в одноразовую базу:
+# временный файл SQLite или, если задан BENCH_DATABASE_SERVER, отдельную базу на этом сервере postgres
+BENCH_DATABASE_SERVER = os.getenv("BENCH_DATABASE_SERVER")
+
+
+async def _admin(server_url: str, statement: str):
+    engine = create_async_engine(server_url, isolation_level="AUTOCOMMIT")
+    try:
+        async with engine.connect() as conn:
+            await conn.execute(text(statement))
+    finally:
+        await engine.dispose()
+
+
+def _remove(path: str):
+    for suffix in ("", "-wal", "-shm", "-journal"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def scratch_database(server_url: str = BENCH_DATABASE_SERVER) -> str:
+    # вызывать до импорта database: движок создаётся при импорте модуля
+    if server_url:
+        name = f"bench_{uuid.uuid4().hex[:12]}"
+        asyncio.run(_admin(server_url, f'CREATE DATABASE "{name}"'))
+        atexit.register(lambda: asyncio.run(_admin(server_url, f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)')))
+        url = make_url(server_url).set(database=name).render_as_string(hide_password=False)
+    else:
+        fd, path = tempfile.mkstemp(prefix="bench_", suffix=".db")
+        os.close(fd)
+        atexit.register(_remove, path)
+        url = f"sqlite+aiosqlite:///{path}"
+    os.environ["DATABASE_URL"] = url
+    return url
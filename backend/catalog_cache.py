@@ -0,0 +1,51 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+
+CATALOG_CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", "256"))
+CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL", "10"))
+
+
+class CatalogCache:
+    # кэш в памяти воркера: bump() сбрасывает его только здесь, изменения с других воркеров
+    # становятся видны не позже чем через ttl
+    def __init__(self, max_entries: int = CATALOG_CACHE_SIZE, ttl: float = CATALOG_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # растёт при каждом bump; ответ, посчитанный до него, в кэш не кладётся
+        self.version = 0
+        self.entries: OrderedDict = OrderedDict()
+
+    def bump(self):
+        self.version += 1
+        self.entries.clear()
+
+    def etag(self, body: bytes, next_cursor: str = None) -> str:
+        # по содержимому ответа: одинаковый на всех воркерах и меняется вместе с данными,
+        # сколько бы ни было bump в этом процессе
+        digest = hashlib.sha1(body)
+        digest.update((next_cursor or "").encode())
+        return f'"{digest.hexdigest()[:16]}"'
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        valid_until, payload = entry
+        if valid_until <= time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return payload
+
+    def put(self, key, version: int, payload):
+        if version != self.version or self.ttl <= 0:
+            return
+        self.entries[key] = (time.monotonic() + self.ttl, payload)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+catalog_cache = CatalogCache()
@@ -0,0 +1,136 @@
+import asyncio
+import json
+import os
+from datetime import datetime
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import DataError, IntegrityError
+from database import AsyncSessionLocal
+from models import ChatMessage
+
+CHAT_HISTORY_BATCH = int(os.getenv("CHAT_HISTORY_BATCH", "500"))
+CHAT_HISTORY_FLUSH_INTERVAL = float(os.getenv("CHAT_HISTORY_FLUSH_INTERVAL", "0.5"))
+CHAT_HISTORY_BUFFER = int(os.getenv("CHAT_HISTORY_BUFFER", "20000"))
+CHAT_HISTORY_REPLAY = int(os.getenv("CHAT_HISTORY_REPLAY", "100"))
+
+
+def conversation_key(first: str, second: str) -> str:
+    return json.dumps(sorted([first, second]), ensure_ascii=False)
+
+
+class ChatHistoryWriter:
+    # сокет только кладёт сообщение в буфер, в базу оно уходит пачкой из фоновой задачи
+    def __init__(self, batch_size: int = CHAT_HISTORY_BATCH, flush_interval: float = CHAT_HISTORY_FLUSH_INTERVAL,
+                 max_buffer: int = CHAT_HISTORY_BUFFER):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.buffer = []
+        self.lock = asyncio.Lock()
+        self.wakeup: asyncio.Event = None
+        self.task = None
+        self.written = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.batches = 0
+
+    async def start(self):
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"Не сохранено сообщений чата при остановке: {len(self.buffer)}", e)
+
+    def add(self, sender: str, recipient: str, message: dict, delivered: bool) -> bool:
+        if len(self.buffer) >= self.max_buffer:
+            self.dropped += 1
+            return False
+        now = datetime.utcnow()
+        self.buffer.append({
+            "conversation": conversation_key(sender, recipient),
+            "sender": sender,
+            "recipient": recipient,
+            "type": message.get("type", "message"),
+            "payload": json.dumps(message, ensure_ascii=False),
+            "created_at": now,
+            "delivered_at": now if delivered else None,
+        })
+        if self.wakeup is not None and len(self.buffer) >= self.batch_size:
+            self.wakeup.set()
+        return True
+
+    async def _insert(self, rows):
+        async with AsyncSessionLocal() as db:
+            await db.execute(insert(ChatMessage), rows)
+            await db.commit()
+        self.written += len(rows)
+        self.batches += 1
+
+    async def flush(self):
+        async with self.lock:
+            while self.buffer:
+                rows = self.buffer[:self.batch_size]
+                try:
+                    await self._insert(rows)
+                    del self.buffer[:len(rows)]
+                except (DataError, IntegrityError):
+                    # пачку отвергла одна из строк: пишем по одной и выбрасываем ту, что не вставляется,
+                    # иначе она навсегда застрянет в голове буфера; ошибки соединения уходят наверх и повторяются целиком
+                    for row in rows:
+                        try:
+                            await self._insert([row])
+                        except (DataError, IntegrityError) as e:
+                            self.rejected += 1
+                            print(f"Сообщение чата {row['sender']} -> {row['recipient']} не сохранено:", e)
+                        self.buffer.pop(0)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                # буфер не трогаем, попробуем ещё раз на следующем тике
+                print("Ошибка при сохранении сообщений чата:", e)
+
+    async def undelivered(self, username: str, limit: int = CHAT_HISTORY_REPLAY):
+        await self.flush()
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(ChatMessage.id, ChatMessage.payload, ChatMessage.created_at)
+                .where(ChatMessage.recipient == username, ChatMessage.delivered_at.is_(None))
+                .order_by(ChatMessage.id)
+                .limit(limit)
+            )
+            return result.all()
+
+    async def mark_delivered(self, ids):
+        if not ids:
+            return
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(ChatMessage).where(ChatMessage.id.in_(ids)).values(delivered_at=datetime.utcnow())
+            )
+            await db.commit()
+
+    def stats(self):
+        return {
+            "buffered": len(self.buffer),
+            "written": self.written,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "rejected": self.rejected,
+        }
+
+
+chat_history = ChatHistoryWriter()
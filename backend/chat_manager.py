@@ -1,32 +1,309 @@
+import asyncio
+import json
+import os
+import time
+import uuid
 from typing import Dict
-from fastapi import WebSocket
+from fastapi import WebSocket, status
+from chat_pubsub import create_pubsub, NOTIFY_MAX_BYTES
+
+CHAT_SEND_QUEUE = int(os.getenv("CHAT_SEND_QUEUE", "256"))
+CHAT_SEND_TIMEOUT = float(os.getenv("CHAT_SEND_TIMEOUT", "10"))
+CHAT_PRESENCE_INTERVAL = float(os.getenv("CHAT_PRESENCE_INTERVAL", "15"))
+CHAT_PRESENCE_DEBOUNCE = float(os.getenv("CHAT_PRESENCE_DEBOUNCE", "0.25"))
+
+
+class ChatConnection:
+    # у каждого сокета своя очередь и свой писатель: медленный клиент не задерживает остальных
+    def __init__(self, manager, username: str, websocket: WebSocket, queue_size: int = CHAT_SEND_QUEUE):
+        self.manager = manager
+        self.username = username
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.task = None
+        self.closed = False
+
+    def start(self):
+        self.task = asyncio.create_task(self._write())
+
+    def stop(self):
+        # wait_for в 3.11 проглатывает отмену, если отправка успела завершиться, поэтому писателя держит ещё и флаг
+        self.closed = True
+        if self.task and self.task is not asyncio.current_task():
+            self.task.cancel()
+
+    def send(self, text: str) -> bool:
+        try:
+            self.queue.put_nowait(text)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def _write(self):
+        try:
+            while not self.closed:
+                text = await self.queue.get()
+                await asyncio.wait_for(self.websocket.send_text(text), self.manager.send_timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.manager.evict(self)
+
+    async def close(self, code: int):
+        self.stop()
+        try:
+            await asyncio.wait_for(self.websocket.close(code=code), self.manager.send_timeout)
+        except Exception:
+            pass
+
 
 class UserChatManager:
-    def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
+    def __init__(self, queue_size: int = CHAT_SEND_QUEUE, send_timeout: float = CHAT_SEND_TIMEOUT,
+                 presence_debounce: float = CHAT_PRESENCE_DEBOUNCE):
+        self.active_connections: Dict[str, ChatConnection] = {}
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        # клиентам уходят только изменения списка за окно presence_debounce
+        self.presence_debounce = presence_debounce
+        self.presence_task = None
+        self.announced = set()
+        self.published_local = set()
+        self.evicted = 0
+        self.closing = set()
+        # пользователи на других воркерах: node_id -> (множество имён, время последнего снимка)
+        self.node_id = uuid.uuid4().hex
+        self.remote_users: Dict[str, tuple] = {}
+        self.presence_parts: Dict[str, tuple] = {}
+        self.presence_version = 0
+        self.pubsub = None
+        self.heartbeat = None
+
+    async def start(self, pubsub=None, presence_interval: float = CHAT_PRESENCE_INTERVAL):
+        self.presence_interval = presence_interval
+        self.pubsub = pubsub or create_pubsub()
+        await self.pubsub.start(self.handle_event)
+        await self.publish({"kind": "presence_sync"})
+        await self.publish_presence()
+        self.heartbeat = asyncio.create_task(self._heartbeat())
+
+    async def stop(self):
+        for task in (self.heartbeat, self.presence_task):
+            if task:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        self.heartbeat = self.presence_task = None
+        if self.pubsub:
+            # пустой снимок, чтобы остальные воркеры сразу убрали наших пользователей
+            self.active_connections, connections = {}, self.active_connections
+            await self.publish_presence()
+            await self.pubsub.stop()
+            self.pubsub = None
+            for conn in connections.values():
+                self._close(conn, status.WS_1001_GOING_AWAY)
+        await asyncio.gather(*self.closing, return_exceptions=True)
+
+    async def publish(self, event: dict) -> bool:
+        if self.pubsub is None:
+            return False
+        event["node"] = self.node_id
+        try:
+            await self.pubsub.publish(event)
+            return True
+        except Exception as e:
+            print("Ошибка публикации события чата:", e)
+            return False
+
+    async def publish_presence(self):
+        # снимок режем на части, чтобы каждая влезла в NOTIFY
+        if self.pubsub is None:
+            return
+        self.published_local = set(self.active_connections)
+        self.presence_version += 1
+        chunks, chunk, size = [], [], 0
+        for username in self.active_connections:
+            length = len(json.dumps(username, ensure_ascii=False).encode()) + 2
+            if chunk and size + length > NOTIFY_MAX_BYTES - 200:
+                chunks.append(chunk)
+                chunk, size = [], 0
+            chunk.append(username)
+            size += length
+        chunks.append(chunk)
+        for part, users in enumerate(chunks):
+            await self.publish({
+                "kind": "presence",
+                "version": self.presence_version,
+                "part": part,
+                "parts": len(chunks),
+                "users": users,
+            })
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.presence_interval)
+            try:
+                await self.publish_presence()
+                deadline = time.monotonic() - 3 * self.presence_interval
+                expired = [node for node, (_, seen) in self.remote_users.items() if seen < deadline]
+                for node in expired:
+                    del self.remote_users[node]
+                    self.presence_parts.pop(node, None)
+                if expired:
+                    self.presence_changed()
+            except Exception as e:
+                print("Ошибка при обновлении присутствия в чате:", e)
+
+    async def handle_event(self, event: dict):
+        node = event.get("node")
+        if node == self.node_id:
+            return
+        kind = event.get("kind")
+        if kind == "direct":
+            self.deliver(event["to"], event["message"])
+        elif kind == "broadcast":
+            self.broadcast(event["message"])
+        elif kind == "presence":
+            self.receive_presence(node, event)
+        elif kind == "presence_delta":
+            self.receive_presence_delta(node, event)
+        elif kind == "presence_sync":
+            await self.publish_presence()
+
+    def receive_presence(self, node: str, event: dict):
+        version, collected = self.presence_parts.get(node, (None, []))
+        if version != event["version"]:
+            collected = []
+        collected.append(event["users"])
+        if len(collected) < event["parts"]:
+            self.presence_parts[node] = (event["version"], collected)
+            return
+        self.presence_parts.pop(node, None)
+        users = {username for part in collected for username in part}
+        previous = self.remote_users.pop(node, (set(), 0))[0]
+        if users:
+            self.remote_users[node] = (users, time.monotonic())
+        if users != previous:
+            self.presence_changed()
+
+    def receive_presence_delta(self, node: str, event: dict):
+        users = self.remote_users.pop(node, (set(), 0))[0]
+        users.difference_update(event["left"])
+        users.update(event["joined"])
+        if users:
+            self.remote_users[node] = (users, time.monotonic())
+        self.presence_changed()
+
+    def online_users(self):
+        users = dict.fromkeys(self.active_connections)
+        for remote, _ in self.remote_users.values():
+            users.update(dict.fromkeys(remote))
+        return list(users)
 
     async def connect(self, username: str, websocket: WebSocket):
         await websocket.accept()
-        self.active_connections[username] = websocket
+        previous = self.active_connections.get(username)
+        conn = ChatConnection(self, username, websocket, self.queue_size)
+        self.active_connections[username] = conn
+        conn.start()
+        if previous:
+            self._close(previous, status.WS_1000_NORMAL_CLOSURE)
+        self.send_user_list(conn)
+        self.presence_changed()
+        return conn
 
-    def disconnect(self, username: str):
-        if username in self.active_connections:
+    def disconnect(self, username: str, websocket: WebSocket = None):
+        conn = self.active_connections.get(username)
+        if conn and (websocket is None or conn.websocket is websocket):
             del self.active_connections[username]
+            conn.stop()
+            self.presence_changed()
+
+    def evict(self, conn: ChatConnection):
+        if self.active_connections.get(conn.username) is conn:
+            del self.active_connections[conn.username]
+            self.evicted += 1
+            self._close(conn, status.WS_1008_POLICY_VIOLATION)
+            self.presence_changed()
+
+    def _close(self, conn: ChatConnection, code: int):
+        task = asyncio.create_task(conn.close(code))
+        self.closing.add(task)
+        task.add_done_callback(self.closing.discard)
+
+    def send_text(self, conn: ChatConnection, text: str):
+        if not conn.send(text):
+            self.evict(conn)
+
+    def deliver(self, recipient: str, message: dict) -> bool:
+        conn = self.active_connections.get(recipient)
+        if conn:
+            self.send_text(conn, json.dumps(message, ensure_ascii=False))
+        return conn is not None
+
+    def is_remote(self, username: str) -> bool:
+        return any(username in users for users, _ in self.remote_users.values())
 
-    async def send_personal_message(self, recipient: str, message: dict):
-        ws = self.active_connections.get(recipient)
-        if ws:
-            await ws.send_json(message)
+    def too_large(self, recipient: str, message: dict) -> bool:
+        # такое событие не влезет в NOTIFY и не дойдёт до других воркеров, поэтому не принимаем его совсем
+        event = {"kind": "direct", "to": recipient, "message": message, "node": self.node_id}
+        return len(json.dumps(event, ensure_ascii=False).encode()) > NOTIFY_MAX_BYTES
 
-    async def broadcast_user_list(self):
-        users = list(self.active_connections.keys())
-        for ws in self.active_connections.values():
-            await ws.send_json({"type": "users", "users": users})
+    async def send_personal_message(self, recipient: str, message: dict) -> bool:
+        if self.deliver(recipient, message):
+            return True
+        # получатель подключён к другому воркеру; если по присутствию его нигде нет, сообщение ждёт переподключения
+        published = await self.publish({"kind": "direct", "to": recipient, "message": message})
+        return published and self.is_remote(recipient)
+
+    def broadcast(self, message: dict):
+        text = json.dumps(message, ensure_ascii=False)
+        for conn in list(self.active_connections.values()):
+            self.send_text(conn, text)
+
+    def send_user_list(self, conn: ChatConnection):
+        # полный снимок только новому или попросившему resync клиенту
+        self.send_text(conn, json.dumps({"type": "users", "users": self.online_users()}, ensure_ascii=False))
+
+    def resync(self, username: str):
+        conn = self.active_connections.get(username)
+        if conn:
+            self.send_user_list(conn)
+
+    def presence_changed(self):
+        if self.presence_task is None:
+            self.presence_task = asyncio.create_task(self._flush_presence())
+
+    async def _flush_presence(self):
+        await asyncio.sleep(self.presence_debounce)
+        # изменения, пришедшие во время рассылки, попадут уже в следующее окно
+        self.presence_task = None
+        online = self.online_users()
+        current = set(online)
+        joined = [username for username in online if username not in self.announced]
+        left = [username for username in self.announced if username not in current]
+        self.announced = current
+        if joined or left:
+            self.broadcast({"type": "presence", "joined": joined, "left": left})
+        if self.pubsub is None:
+            return
+        local = set(self.active_connections)
+        joined = list(local - self.published_local)
+        left = list(self.published_local - local)
+        if not joined and not left:
+            return
+        delta = {"kind": "presence_delta", "joined": joined, "left": left}
+        if len(json.dumps(delta, ensure_ascii=False).encode()) > NOTIFY_MAX_BYTES - 200:
+            await self.publish_presence()
+        else:
+            self.published_local = local
+            await self.publish(delta)
+
+    async def broadcast_all(self, message: dict):
+        self.broadcast(message)
+        await self.publish({"kind": "broadcast", "message": message})
 
     async def broadcast_book_available(self, book_id: int, book_title: str):
-        for ws in self.active_connections.values():
-            await ws.send_json({
-                "type": "book_available",
-                "book_id": book_id,
-                "book_title": book_title
-            })
+        await self.broadcast_all({
+            "type": "book_available",
+            "book_id": book_id,
+            "book_title": book_title
+        })
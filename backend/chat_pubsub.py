@@ -0,0 +1,124 @@
+import asyncio
+import json
+import os
+from sqlalchemy.engine import make_url
+from database import DATABASE_URL
+
+CHAT_PUBSUB = os.getenv("CHAT_PUBSUB") or ("postgres" if (DATABASE_URL or "").startswith("postgresql") else "memory")
+CHAT_PUBSUB_CHANNEL = os.getenv("CHAT_PUBSUB_CHANNEL", "chat_events")
+CHAT_PUBSUB_RECONNECT_DELAY = float(os.getenv("CHAT_PUBSUB_RECONNECT_DELAY", "2"))
+
+# ограничение postgres на размер payload у NOTIFY
+NOTIFY_MAX_BYTES = 7999
+
+
+class InProcessPubSub:
+    # один воркер: событие сразу уходит обработчику
+    def __init__(self, channel: str = CHAT_PUBSUB_CHANNEL):
+        self.channel = channel
+        self.handler = None
+
+    async def start(self, handler):
+        self.handler = handler
+
+    async def stop(self):
+        self.handler = None
+
+    async def publish(self, event: dict):
+        if self.handler:
+            await self.handler(event)
+
+
+class PostgresPubSub:
+    # LISTEN/NOTIFY на отдельном соединении asyncpg, собственные события приходят обратно так же, как чужие
+    def __init__(self, database_url: str = DATABASE_URL, channel: str = CHAT_PUBSUB_CHANNEL,
+                 reconnect_delay: float = CHAT_PUBSUB_RECONNECT_DELAY):
+        url = make_url(database_url)
+        self.dsn = url.set(drivername="postgresql").render_as_string(hide_password=False)
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+        self.handler = None
+        self.conn = None
+        self.lock = asyncio.Lock()
+        self.events: asyncio.Queue = None
+        self.tasks = []
+        self.lost = None
+        self.connected = None
+
+    async def start(self, handler):
+        self.handler = handler
+        self.events = asyncio.Queue()
+        self.connected = asyncio.Event()
+        self.tasks = [asyncio.create_task(self._run()), asyncio.create_task(self._dispatch())]
+        await self.connected.wait()
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        await self._close()
+
+    async def _close(self):
+        conn, self.conn = self.conn, None
+        if conn is not None and not conn.is_closed():
+            try:
+                await conn.close(timeout=5)
+            except Exception:
+                conn.terminate()
+
+    async def _run(self):
+        import asyncpg
+
+        while True:
+            try:
+                self.lost = asyncio.Event()
+                self.conn = await asyncpg.connect(self.dsn)
+                self.conn.add_termination_listener(lambda _: self.lost.set())
+                await self.conn.add_listener(self.channel, self._on_notify)
+                self.connected.set()
+                await self.lost.wait()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print("Ошибка соединения pub/sub чата:", e)
+            await self._close()
+            # при первом запуске не держим старт приложения, сообщения до переподключения теряются
+            self.connected.set()
+            await asyncio.sleep(self.reconnect_delay)
+
+    def _on_notify(self, connection, pid, channel, payload):
+        try:
+            self.events.put_nowait(json.loads(payload))
+        except ValueError:
+            pass
+
+    async def _dispatch(self):
+        # один обработчик на все уведомления, чтобы сохранить их порядок
+        while True:
+            event = await self.events.get()
+            try:
+                await self.handler(event)
+            except Exception as e:
+                print("Ошибка обработки события чата:", e)
+
+    async def publish(self, event: dict):
+        payload = json.dumps(event, ensure_ascii=False)
+        if len(payload.encode()) > NOTIFY_MAX_BYTES:
+            raise ValueError("Сообщение слишком длинное")
+        async with self.lock:
+            if self.conn is None or self.conn.is_closed():
+                raise ConnectionError("Нет соединения с pub/sub чата")
+            await self.conn.execute("SELECT pg_notify($1, $2)", self.channel, payload)
+
+
+CHAT_PUBSUB_BACKENDS = {
+    "memory": InProcessPubSub,
+    "postgres": PostgresPubSub,
+}
+
+
+def create_pubsub(name: str = CHAT_PUBSUB, channel: str = CHAT_PUBSUB_CHANNEL):
+    if name not in CHAT_PUBSUB_BACKENDS:
+        raise ValueError(f"Неизвестный pub/sub для чата: {name}")
+    return CHAT_PUBSUB_BACKENDS[name](channel=channel)
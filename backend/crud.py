@@ -1,6 +1,7 @@
 from fastapi import HTTPException
-from models import User
-from sqlalchemy import select
+from models import User, Book, Rent, Request, Comment
+from sqlalchemy import select, delete, update, tuple_
+from datetime import datetime
 
 async def get_user_by_username(db, username):
     result = await db.execute(
@@ -10,3 +11,57 @@ async def get_user_by_username(db, username):
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
     return user
+
+async def lock_books(db, book_ids):
+    ids = sorted(set(book_ids))
+    if ids:
+        await db.execute(select(Book.id).where(Book.id.in_(ids)).order_by(Book.id).with_for_update())
+
+async def release_expired_rents(db, book_ids):
+    expired = (await db.execute(
+        delete(Rent)
+        .where(Rent.book_id.in_(list(book_ids)), Rent.expires_at <= datetime.utcnow())
+        .returning(Rent.user_id, Rent.book_id)
+    )).all()
+    if expired:
+        await db.execute(
+            update(Request)
+            .where(tuple_(Request.user_id, Request.book_id).in_([tuple(r) for r in expired]), Request.status == "approved")
+            .values(status="expired")
+        )
+    return [user_id for user_id, _ in expired]
+
+async def rented_book_ids(db, book_ids=None, user_id=None, active_at=None):
+    stmt = select(Rent.book_id)
+    if book_ids is not None:
+        stmt = stmt.where(Rent.book_id.in_(list(book_ids)))
+    if user_id is not None:
+        stmt = stmt.where(Rent.user_id == user_id)
+    if active_at is not None:
+        stmt = stmt.where(Rent.expires_at > active_at)
+    result = await db.execute(stmt)
+    return set(result.scalars().all())
+
+async def add_rating(db, book_id, rating):
+    await db.execute(
+        update(Book)
+        .where(Book.id == book_id)
+        .values(rating_count=Book.rating_count + 1, rating_sum=Book.rating_sum + rating)
+    )
+
+async def remove_user_ratings(db, user_id):
+    removed = (await db.execute(
+        delete(Comment).where(Comment.user_id == user_id).returning(Comment.book_id, Comment.rating)
+    )).all()
+    per_book = {}
+    for book_id, rating in removed:
+        if rating is not None:
+            count, total = per_book.get(book_id, (0, 0))
+            per_book[book_id] = (count + 1, total + rating)
+    for book_id, (count, total) in sorted(per_book.items()):
+        await db.execute(
+            update(Book)
+            .where(Book.id == book_id)
+            .values(rating_count=Book.rating_count - count, rating_sum=Book.rating_sum - total)
+        )
+    return bool(per_book)
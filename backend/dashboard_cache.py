@@ -0,0 +1,49 @@
+import os
+import time
+from collections import OrderedDict
+
+DASHBOARD_CACHE_SIZE = int(os.getenv("DASHBOARD_CACHE_SIZE", "10000"))
+DASHBOARD_CACHE_TTL = float(os.getenv("DASHBOARD_CACHE_TTL", "60"))
+
+
+class DashboardCache:
+    def __init__(self, max_entries: int = DASHBOARD_CACHE_SIZE, ttl: float = DASHBOARD_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # растёт при каждой инвалидации; ответ, посчитанный до неё, в кэш не кладётся
+        self.generation = 0
+        self.entries: OrderedDict = OrderedDict()
+
+    def get(self, user_id: int):
+        entry = self.entries.get(user_id)
+        if entry is None:
+            return None
+        valid_until, payload = entry
+        if valid_until <= time.monotonic():
+            del self.entries[user_id]
+            return None
+        self.entries.move_to_end(user_id)
+        return payload
+
+    def put(self, user_id: int, generation: int, payload, max_age: float = None):
+        if generation != self.generation:
+            return
+        ttl = self.ttl if max_age is None else min(self.ttl, max_age)
+        if ttl <= 0:
+            return
+        self.entries[user_id] = (time.monotonic() + ttl, payload)
+        self.entries.move_to_end(user_id)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, *user_ids):
+        self.generation += 1
+        for user_id in user_ids:
+            self.entries.pop(user_id, None)
+
+    def clear(self):
+        self.generation += 1
+        self.entries.clear()
+
+
+dashboard_cache = DashboardCache()
@@ -1,6 +1,8 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from models import Base
+from search import init_search
+from facets import init_facets
 import os
 from dotenv import load_dotenv
 
@@ -15,4 +17,6 @@ AsyncSessionLocal = sessionmaker(
 
 async def init_db():
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
\ No newline at end of file
+        await conn.run_sync(Base.metadata.create_all)
+        await init_search(conn)
+        await init_facets(conn)
\ No newline at end of file
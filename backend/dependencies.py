@@ -4,18 +4,21 @@ from database import AsyncSessionLocal
 from models import User
 from jose import JWTError, jwt
 from auth import oauth2_scheme
+from principal_cache import Principal, principal_cache
 import auth
 
 async def get_db():
     async with AsyncSessionLocal() as db:
         yield db
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
+async def resolve_user(token: str, db: AsyncSession):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    if not token:
+        raise credentials_exception
     try:
         payload = jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
         username: str = payload.get("sub")
@@ -23,14 +26,23 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession
             raise credentials_exception
     except JWTError:
         raise credentials_exception
+    principal = principal_cache.get(username)
+    if principal is not None:
+        return principal
+    generation = principal_cache.generation
     from sqlalchemy import select
     result = await db.execute(
-        select(User).where(User.username == username)
+        select(User.id, User.username, User.role).where(User.username == username)
     )
-    user = result.scalars().first()
-    if user is None:
+    row = result.first()
+    if row is None:
         raise credentials_exception
-    return user
+    principal = Principal(*row)
+    principal_cache.put(principal, generation)
+    return principal
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
+    return await resolve_user(token, db)
 
 def require_role(required_role: str):
     async def role_checker(user=Depends(get_current_user)):
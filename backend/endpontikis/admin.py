@@ -3,8 +3,12 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from dependencies import get_db, require_role
 from models import User, Book, Rent, Request, Comment
 from schemas import RoleUpdate, UsernameIn, BookIdIn
-from passlib.hash import bcrypt
-from crud import get_user_by_username
+import auth
+from crud import get_user_by_username, remove_user_ratings
+from catalog_cache import catalog_cache
+from dashboard_cache import dashboard_cache
+from principal_cache import principal_cache
+from chat_history import chat_history
 import os
 from sqlalchemy import select, delete
 import re
@@ -40,7 +44,7 @@ async def admin_add_user(
     result = await db.execute(select(User).where(User.email == user["email"]))
     if result.scalars().first():
         raise HTTPException(status_code=400, detail="Пользователь с таким email уже зарегистрирован.")
-    hashed_password = bcrypt.hash(user["password"])
+    hashed_password = await auth.get_password_hash_async(user["password"])
     new_user = User(username=user["username"], password=hashed_password, role=user["role"], email=user["email"])
     db.add(new_user)
     await db.commit()
@@ -59,11 +63,15 @@ async def admin_delete_user(
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден.")
 
-    await db.execute(delete(Comment).where(Comment.user_id == user.id))
+    ratings_changed = await remove_user_ratings(db, user.id)
     await db.execute(delete(Request).where(Request.user_id == user.id))
     await db.execute(delete(Rent).where(Rent.user_id == user.id))
     await db.delete(user)
     await db.commit()
+    principal_cache.invalidate(user.username)
+    dashboard_cache.invalidate(user.id)
+    if ratings_changed:
+        catalog_cache.bump()
     return {"message": "Пользователь удалён"}
 
 @router.post("/admin/edit_user")
@@ -90,10 +98,11 @@ async def admin_edit_user(
     user = result.scalars().first()
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден.")
+    old_username = user.username
     if new_username:
         user.username = new_username
     if new_password:
-        user.password = bcrypt.hash(new_password)
+        user.password = await auth.get_password_hash_async(new_password)
     if new_role:
         user.role = new_role
     if new_email:
@@ -102,6 +111,8 @@ async def admin_edit_user(
             raise HTTPException(status_code=400, detail="Пользователь с таким email уже зарегистрирован.")
         user.email = new_email
     await db.commit()
+    principal_cache.invalidate(old_username, user.username)
+    dashboard_cache.invalidate(user.id)
     return {"message": "Пользователь обновлён"}
 
 @router.post("/change-role")
@@ -109,5 +120,14 @@ async def change_role(data: RoleUpdate, db: AsyncSession = Depends(get_db)):
     user = await get_user_by_username(db, data.username)
     user.role = data.new_role
     await db.commit()
+    principal_cache.invalidate(user.username)
+    dashboard_cache.invalidate(user.id)
     return {"message": f"Роль пользователя {data.username} изменена на {data.new_role}"}
 
+@router.get("/admin/metrics")
+async def admin_metrics(current=Depends(require_role("admin"))):
+    return {
+        "principal_cache": principal_cache.stats(),
+        "password_hasher": auth.password_hasher.stats(),
+        "chat_history": chat_history.stats(),
+    }
@@ -4,17 +4,13 @@ from fastapi.security import OAuth2PasswordRequestForm
 import auth
 from models import User
 from dependencies import get_db
-from passlib.hash import bcrypt
 from schemas import ChangePasswordIn, EmailIn
-from uuid import uuid4
-import os
-import smtplib
-from email.mime.text import MIMEText
+from reset_tokens import reset_token_store
+from mailer import mailer
 from sqlalchemy import select
 import re
 
 router = APIRouter()
-reset_tokens = {}
 
 @router.post("/register")
 async def register(
@@ -44,7 +40,7 @@ async def register(
     result = await db.execute(select(User).where(User.email == email))
     if result.scalars().first():
         raise HTTPException(status_code=400, detail="Пользователь с таким email уже существует")
-    hashed_password = auth.get_password_hash(password)
+    hashed_password = await auth.get_password_hash_async(password)
     new_user = User(username=username, password=hashed_password, role="reader", email=email)
     db.add(new_user)
     await db.commit()
@@ -55,7 +51,7 @@ async def register(
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
     result = await db.execute(select(User).where(User.username == form_data.username))
     user = result.scalars().first()
-    if not user or not auth.verify_password(form_data.password, user.password):
+    if not user or not await auth.verify_password_async(form_data.password, user.password):
         raise HTTPException(status_code=400, detail="Неверные учетные данные")
     access_token = auth.create_access_token(data={"sub": user.username, "role": user.role})
     return {"access_token": access_token, "token_type": "bearer", "role": user.role}
@@ -66,7 +62,7 @@ async def change_password(data: ChangePasswordIn, db: AsyncSession = Depends(get
     user = result.scalars().first()
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
-    if not auth.verify_password(data.old_password, user.password):
+    if not await auth.verify_password_async(data.old_password, user.password):
         raise HTTPException(status_code=400, detail="Старый пароль неверен")
     if len(data.new_password) < 8:
         raise HTTPException(status_code=400, detail="минимум 8 символов")
@@ -78,12 +74,10 @@ async def change_password(data: ChangePasswordIn, db: AsyncSession = Depends(get
         raise HTTPException(status_code=400, detail="хотя бы одну цифру")
     if not re.search(r"[^A-Za-z0-9]", data.new_password):
         raise HTTPException(status_code=400, detail="хотя бы один специальный символ")
-    user.password = auth.get_password_hash(data.new_password)
+    user.password = await auth.get_password_hash_async(data.new_password)
     await db.commit()
     return {"message": "Пароль успешно изменён"}
 
-reset_tokens = {}
-
 @router.post("/request_password_reset")
 async def request_password_reset(data: EmailIn, db: AsyncSession = Depends(get_db)):
     email = data.email
@@ -91,35 +85,18 @@ async def request_password_reset(data: EmailIn, db: AsyncSession = Depends(get_d
     user = result.scalars().first()
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь с таким email не найден")
-    token = str(uuid4())
-    reset_tokens[token] = user.username
+    token = await reset_token_store.issue(user.id)
     reset_link = f"http://localhost:3000/reset-password/{token}"
-    try:
-        smtp_user = os.environ.get("GMAIL_USER")
-        smtp_pass = os.environ.get("GMAIL_PASS")
-        if not smtp_user or not smtp_pass:
-            print("GMAIL_USER or GMAIL_PASS not set in environment")
-            raise Exception("GMAIL_USER or GMAIL_PASS not set in environment")
-        msg = MIMEText(f"Для сброса пароля перейдите по ссылке: {reset_link}")
-        msg["Subject"] = "Сброс пароля"
-        msg["From"] = smtp_user
-        msg["To"] = email
-        with smtplib.SMTP("smtp.gmail.com", 587) as server:
-            server.ehlo()
-            server.starttls()
-            server.login(smtp_user, smtp_pass)
-            server.sendmail(smtp_user, [email], msg.as_string())
-    except Exception as e:
-        print("Ошибка при отправке email:", e)
-        raise HTTPException(status_code=500, detail=f"Ошибка отправки email: {e}")
+    if not mailer.send(email, "Сброс пароля", f"Для сброса пароля перейдите по ссылке: {reset_link}"):
+        raise HTTPException(status_code=503, detail="Очередь отправки писем переполнена, попробуйте позже")
     return {"message": "Письмо для сброса пароля отправлено на почту"}
 
 @router.post("/reset_password")
 async def reset_password(token: str = Body(...), new_password: str = Body(...), db: AsyncSession = Depends(get_db)):
-    username = reset_tokens.get(token)
-    if not username:
+    user_id = await reset_token_store.get(token)
+    if not user_id:
         raise HTTPException(status_code=400, detail="Неверный или устаревший токен")
-    result = await db.execute(select(User).where(User.username == username))
+    result = await db.execute(select(User).where(User.id == user_id))
     user = result.scalars().first()
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
@@ -133,7 +110,12 @@ async def reset_password(token: str = Body(...), new_password: str = Body(...),
         raise HTTPException(status_code=400, detail="хотя бы одну цифру")
     if not re.search(r"[^A-Za-z0-9]", new_password):
         raise HTTPException(status_code=400, detail="хотя бы один специальный символ")
-    user.password = auth.get_password_hash(new_password)
+    # сначала медленный bcrypt, потом гасим токен и меняем пароль одной транзакцией:
+    # если commit не пройдёт, токен останется действительным
+    password_hash = await auth.get_password_hash_async(new_password)
+    if await reset_token_store.consume(token, db) != user.id:
+        raise HTTPException(status_code=400, detail="Неверный или устаревший токен")
+    user.password = password_hash
     await db.commit()
-    del reset_tokens[token]
+    await reset_token_store.consumed(token)
     return {"message": "Пароль успешно сброшен"}
\ No newline at end of file
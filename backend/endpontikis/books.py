@@ -1,32 +1,39 @@
-from fastapi import APIRouter, Depends, HTTPException, Form, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, Form, UploadFile, File, Header, Query, Request, Response
+from fastapi.responses import FileResponse
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import or_, select
-from dependencies import get_db, require_role
+from sqlalchemy import BigInteger, and_, cast, func, or_, select
+from dependencies import get_db, get_current_user, require_role
 from models import Book
+from facets import FACETS, add_book_facets, get_facet_counts
+from catalog_cache import catalog_cache
+from http_cache import etag_matches
+from pdf_delivery import deliver_book_file, get_book_file
+from pagination import MAX_PAGE_SIZE, decode_cursor, encode_cursor
+from search import apply_search, index_book
+from storage import discard_pdf, settle_pdf, store_pdf
+from ingest import ingest_worker
+import json
 import os
 
 router = APIRouter()
 
-@router.get("/books")
-async def get_books(
-    query: str = None,
-    author: str = None,
-    genre: str = None,
-    publisher: str = None,
-    db: AsyncSession = Depends(get_db)
-):
-    stmt = select(Book)
+BOOK_FIELDS = (
+    "id", "title", "description", "cover_url", "author", "genre", "publisher", "page_count", "ingest_status",
+    "rating_count", "rating_avg",
+)
+
+def parse_fields(fields: str):
+    if not fields:
+        return list(BOOK_FIELDS)
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in BOOK_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Неизвестные поля: {', '.join(unknown)}")
+    return ["id"] + [f for f in BOOK_FIELDS if f in requested and f != "id"]
+
+def catalog_filters(stmt, db, query: str = None, author: str = None, genre: str = None, publisher: str = None):
     filters = []
-    if query:
-        filters.append(
-            or_(
-                Book.author.ilike(f"%{query}%"),
-                Book.genre.ilike(f"%{query}%"),
-                Book.publisher.ilike(f"%{query}%"),
-                Book.title.ilike(f"%{query}%"),
-                Book.description.ilike(f"%{query}%")
-            )
-        )
     if author:
         filters.append(Book.author.ilike(f"%{author}%"))
     if genre:
@@ -35,20 +42,92 @@ async def get_books(
         filters.append(Book.publisher.ilike(f"%{publisher}%"))
     if filters:
         stmt = stmt.where(*filters)
-    result = await db.execute(stmt)
-    books = result.scalars().all()
-    return [
-        {
-            "id": book.id,
-            "title": book.title,
-            "description": book.description,
-            "cover_url": book.cover_url,
-            "author": book.author,
-            "genre": book.genre,
-            "publisher": book.publisher
-        }
-        for book in books
-    ]
+    rank = None
+    if query:
+        stmt, rank = apply_search(stmt, db, query)
+    return stmt, rank
+
+RANK_SCALE = 1000000
+
+
+def catalog_query(db, columns, query: str = None, author: str = None, genre: str = None, publisher: str = None,
+                  limit: int = None, after: str = None):
+    stmt = select(*[getattr(Book, f) for f in columns])
+    stmt, rank = catalog_filters(stmt, db, query, author, genre, publisher)
+    if rank is not None:
+        # float-ранг из курсора может не совпасть с пересчитанным в базе до последнего бита,
+        # поэтому сортируем и режем страницы по целому ключу: ранг с точностью до RANK_SCALE
+        rank_key = cast(func.round(rank * RANK_SCALE), BigInteger)
+        stmt = stmt.add_columns(rank_key.label("rank")).order_by(rank_key.desc(), Book.id)
+        if after:
+            last_rank, last_id = decode_cursor(after, 2)
+            if not isinstance(last_rank, int) or not isinstance(last_id, int):
+                raise HTTPException(status_code=400, detail="Некорректный курсор.")
+            stmt = stmt.where(or_(rank_key < last_rank, and_(rank_key == last_rank, Book.id > last_id)))
+    else:
+        stmt = stmt.order_by(Book.id)
+        if after:
+            last_id, = decode_cursor(after, 1)
+            stmt = stmt.where(Book.id > last_id)
+    if limit:
+        stmt = stmt.limit(limit + 1)
+    return stmt, rank
+
+@router.get("/books")
+async def get_books(
+    query: str = None,
+    author: str = None,
+    genre: str = None,
+    publisher: str = None,
+    fields: str = None,
+    limit: int = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: str = None,
+    if_none_match: str = Header(None),
+    db: AsyncSession = Depends(get_db)
+):
+    columns = parse_fields(fields)
+    key = (query, author, genre, publisher, tuple(columns), limit, after)
+    version = catalog_cache.version
+    cached = catalog_cache.get(key)
+    if cached is None:
+        stmt, rank = catalog_query(db, columns, query, author, genre, publisher, limit, after)
+        rows = (await db.execute(stmt)).all()
+        next_cursor = None
+        if limit and len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = encode_cursor(last.rank, last.id) if rank is not None else encode_cursor(last.id)
+        body = json.dumps([{f: getattr(row, f) for f in columns} for row in rows], ensure_ascii=False).encode()
+        cached = (body, next_cursor, catalog_cache.etag(body, next_cursor))
+        catalog_cache.put(key, version, cached)
+    body, next_cursor, etag = cached
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@router.get("/books/facets")
+async def get_book_facets(
+    query: str = None,
+    author: str = None,
+    genre: str = None,
+    publisher: str = None,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_db)
+):
+    if not (query or author or genre or publisher):
+        return await get_facet_counts(db, limit)
+    result = {}
+    for facet in FACETS:
+        column = getattr(Book, facet)
+        stmt = select(column, func.count(Book.id).label("count"))
+        stmt, _ = catalog_filters(stmt, db, query, author, genre, publisher)
+        stmt = stmt.where(column.isnot(None)).group_by(column).order_by(func.count(Book.id).desc(), column).limit(limit)
+        rows = (await db.execute(stmt)).all()
+        result[facet] = [{"value": value, "count": count} for value, count in rows]
+    return result
 
 @router.post("/add_books")
 async def add_book_with_pdf(
@@ -70,6 +149,7 @@ async def add_book_with_pdf(
             raise HTTPException(status_code=400, detail=f"Поле '{field}' должно быть строкой.")
     if not pdf_file.filename.lower().endswith('.pdf') or pdf_file.content_type != "application/pdf":
         raise HTTPException(status_code=400, detail="Пожалуйста, загрузите файл в формате PDF.")
+    stored = await store_pdf(pdf_file)
     new_book = Book(
         title=title,
         author=author,
@@ -77,26 +157,41 @@ async def add_book_with_pdf(
         publisher=publisher,
         description=description,
         cover_url=cover_url,
+        pdf_path=stored.path,
+        pdf_sha256=stored.sha256,
+        pdf_size=stored.size,
     )
-    db.add(new_book)
-    await db.commit()
-    await db.refresh(new_book)
-    os.makedirs("books", exist_ok=True)
-    file_path = f"books/{new_book.id}.pdf"
-    with open(file_path, "wb") as f:
-        f.write(await pdf_file.read())
-    new_book.pdf_path = file_path
-    await db.commit()
+    try:
+        db.add(new_book)
+        await db.flush()
+        await index_book(db, new_book)
+        await add_book_facets(db, new_book)
+        await db.commit()
+    except BaseException:
+        await db.rollback()
+        await discard_pdf(db, stored)
+        raise
+    await settle_pdf(stored)
+    catalog_cache.bump()
+    ingest_worker.submit(new_book.id)
     return {"message": "Книга добавлена с PDF", "book_id": new_book.id}
 
 @router.get("/read/{book_id}")
-async def read_book(book_id: int, db: AsyncSession = Depends(get_db)):
+async def read_book(
+    book_id: int,
+    request: Request,
+    current=Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
     if not isinstance(book_id, int):
         raise HTTPException(status_code=400, detail="ID книги должен быть целым числом.")
-    result = await db.execute(select(Book).where(Book.id == book_id))
-    book = result.scalars().first()
-    if not book or not book.pdf_path or not os.path.exists(book.pdf_path):
-        raise HTTPException(status_code=404, detail="Файл книги не найден.")
-    from fastapi.responses import FileResponse
-    return FileResponse(book.pdf_path, media_type="application/pdf", filename=os.path.basename(book.pdf_path))
+    book_file = await get_book_file(db, book_id)
+    return deliver_book_file(request, book_file, f"{book_id}.pdf")
+
 
+@router.get("/books/{book_id}/thumbnail")
+async def get_book_thumbnail(book_id: int, db: AsyncSession = Depends(get_db)):
+    thumbnail_path = (await db.execute(select(Book.thumbnail_path).where(Book.id == book_id))).scalar()
+    if not thumbnail_path or not await run_in_threadpool(os.path.isfile, thumbnail_path):
+        raise HTTPException(status_code=404, detail="Обложка не найдена.")
+    return FileResponse(thumbnail_path, media_type="image/png")
@@ -1,13 +1,54 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, WebSocket, WebSocketDisconnect, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from chat_manager import UserChatManager
+from chat_history import chat_history, conversation_key
+from database import AsyncSessionLocal
+from dependencies import get_db, get_current_user, resolve_user
+from pagination import MAX_PAGE_SIZE, decode_cursor, encode_cursor
+from models import ChatMessage
+import json
 
 router = APIRouter()
 user_chat_manager = UserChatManager()
 
+
+async def relay(sender: str, recipient: str, message: dict):
+    if user_chat_manager.too_large(recipient, message):
+        user_chat_manager.deliver(sender, {"type": "error", "detail": "Сообщение слишком длинное."})
+        return
+    delivered = await user_chat_manager.send_personal_message(recipient, message)
+    chat_history.add(sender, recipient, message, delivered)
+
+
+async def deliver_undelivered(username: str):
+    try:
+        rows = await chat_history.undelivered(username)
+        sent = []
+        for row in rows:
+            message = json.loads(row.payload)
+            message["created_at"] = row.created_at.isoformat()
+            if not user_chat_manager.deliver(username, message):
+                break
+            sent.append(row.id)
+        await chat_history.mark_delivered(sent)
+    except Exception as e:
+        print("Ошибка при доставке сообщений чата после переподключения:", e)
+
+
 @router.websocket("/ws/chat/{username}")
-async def websocket_chat(websocket: WebSocket, username: str):
+async def websocket_chat(websocket: WebSocket, username: str, token: str = None):
+    # до подключения: иначе любой, назвавшись чужим именем, получит его недоставленные сообщения
+    async with AsyncSessionLocal() as db:
+        try:
+            user = await resolve_user(token, db)
+        except HTTPException:
+            user = None
+    if not user or user.username != username:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
     await user_chat_manager.connect(username, websocket)
-    await user_chat_manager.broadcast_user_list()
+    await deliver_undelivered(username)
     try:
         while True:
             data = await websocket.receive_json()
@@ -16,16 +57,18 @@ async def websocket_chat(websocket: WebSocket, username: str):
                 recipient = data.get("to")
                 msg = data.get("message")
                 if recipient and msg:
-                    await user_chat_manager.send_personal_message(
-                        recipient,
+                    await relay(
+                        username, recipient,
                         {"type": "message", "from": username, "to": recipient, "message": msg}
                     )
+            elif msg_type == "resync":
+                user_chat_manager.resync(username)
             elif msg_type == "book_offer":
                 recipient = data.get("to")
                 book = data.get("book")
                 if recipient and book:
-                    await user_chat_manager.send_personal_message(
-                        recipient,
+                    await relay(
+                        username, recipient,
                         {
                             "type": "book_offer",
                             "from": username,
@@ -38,8 +81,8 @@ async def websocket_chat(websocket: WebSocket, username: str):
                 book = data.get("book")
                 accepted = data.get("accepted")
                 if recipient and book is not None:
-                    await user_chat_manager.send_personal_message(
-                        recipient,
+                    await relay(
+                        username, recipient,
                         {
                             "type": "book_offer_response",
                             "from": username,
@@ -49,5 +92,39 @@ async def websocket_chat(websocket: WebSocket, username: str):
                         }
                     )
     except WebSocketDisconnect:
-        user_chat_manager.disconnect(username)
-        await user_chat_manager.broadcast_user_list()
+        pass
+    finally:
+        user_chat_manager.disconnect(username, websocket)
+
+
+@router.get("/chat/history/{username}")
+async def chat_history_page(
+    username: str,
+    response: Response,
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    after: str = None,
+    current=Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    # свежие сообщения этого воркера могли ещё не дойти до базы
+    await chat_history.flush()
+    stmt = select(ChatMessage).where(ChatMessage.conversation == conversation_key(current.username, username))\
+        .order_by(ChatMessage.id.desc()).limit(limit + 1)
+    if after:
+        message_id, = decode_cursor(after, 1)
+        if not isinstance(message_id, int):
+            raise HTTPException(status_code=400, detail="Некорректный курсор.")
+        stmt = stmt.where(ChatMessage.id < message_id)
+    messages = (await db.execute(stmt)).scalars().all()
+    if len(messages) > limit:
+        messages = messages[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(messages[-1].id)
+    return [
+        {
+            **json.loads(message.payload),
+            "id": message.id,
+            "created_at": message.created_at,
+            "delivered": message.delivered_at is not None
+        }
+        for message in messages
+    ]
@@ -0,0 +1,250 @@
+from fastapi import APIRouter, Depends, HTTPException, Form, UploadFile, File
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import and_, insert, or_, select, update
+from sqlalchemy.exc import SQLAlchemyError
+from starlette.concurrency import run_in_threadpool
+from pydantic import ValidationError
+from dependencies import get_db, require_role
+from database import AsyncSessionLocal
+from models import Book, BookImport
+from schemas import BookCreate
+from catalog_cache import catalog_cache
+from facets import add_facet_counts, count_facets
+from search import index_books
+from storage import discard_pdf, settle_pdf, store_pdf_file
+from ingest import ingest_worker
+from datetime import datetime, timedelta
+from uuid import uuid4
+import csv
+import io
+import json
+import os
+import zipfile
+
+router = APIRouter()
+
+BULK_IMPORT_BATCH_SIZE = int(os.getenv("BULK_IMPORT_BATCH_SIZE", "500"))
+BULK_IMPORT_STALE = int(os.getenv("BULK_IMPORT_STALE", "300"))
+MAX_STORED_ERRORS = 1000
+
+
+class ManifestReader:
+    # читает манифест построчно из байтового файла и помнит смещение после последней отданной строки:
+    # по нему прерванный импорт продолжается seek'ом, без повторного чтения готовой части
+    def __init__(self, upload: UploadFile, offset: int = 0):
+        self.file = upload.file
+        self.is_csv = upload.filename.lower().endswith(".csv")
+        self.offset = 0
+        self.fieldnames = None
+        self.file.seek(0)
+        if self.is_csv:
+            self.fieldnames = next(csv.reader(self.lines()), None)
+        if offset:
+            if self.file.seek(0, os.SEEK_END) < offset:
+                raise ValueError("манифест короче уже импортированной части")
+            self.file.seek(offset)
+            self.offset = offset
+
+    def lines(self):
+        while True:
+            line = self.file.readline()
+            if not line:
+                return
+            self.offset = self.file.tell()
+            yield line.decode("utf-8-sig")
+
+    def __iter__(self):
+        if self.is_csv:
+            if self.fieldnames:
+                yield from csv.DictReader(self.lines(), fieldnames=self.fieldnames)
+            return
+        for line in self.lines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                yield e
+
+
+def read_batch(rows, size: int):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            break
+    return batch
+
+
+def prepare_row(row, archive, stored_files):
+    if isinstance(row, Exception):
+        raise ValueError(f"некорректная строка: {row}")
+    if not isinstance(row, dict):
+        raise ValueError("строка должна быть объектом")
+    pdf_name = row.get("pdf") or None
+    book = BookCreate(**{k: v for k, v in row.items() if k != "pdf"}).model_dump()
+    book.update(pdf_path=None, pdf_sha256=None, pdf_size=None, ingest_status=None)
+    if pdf_name:
+        if archive is None:
+            raise ValueError(f"архив не передан, а строка ссылается на {pdf_name}")
+        try:
+            with archive.open(pdf_name) as src:
+                stored = store_pdf_file(src)
+            stored_files.append(stored)
+        except KeyError:
+            raise ValueError(f"файл {pdf_name} не найден в архиве")
+        book.update(pdf_path=stored.path, pdf_sha256=stored.sha256, pdf_size=stored.size, ingest_status="pending")
+    return book
+
+
+def prepare_batch(rows, archive, first_row: int, stored_files):
+    books, errors = [], []
+    for n, row in enumerate(rows, start=first_row):
+        try:
+            books.append(prepare_row(row, archive, stored_files))
+        except ValidationError as e:
+            errors.append({"row": n, "error": "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())})
+        except (ValueError, TypeError, zipfile.BadZipFile) as e:
+            errors.append({"row": n, "error": str(e)})
+    return books, errors
+
+
+def import_state(book_import: BookImport):
+    return {
+        "import_id": book_import.id,
+        "status": book_import.status,
+        "rows_done": book_import.rows_done,
+        "manifest_offset": book_import.manifest_offset,
+        "inserted": book_import.inserted,
+        "failed": book_import.failed,
+    }
+
+
+async def run_import(import_id: str, manifest: UploadFile, archive_file: UploadFile):
+    archive = None
+    checkpoint = {"import_id": import_id}
+    # файлы текущей пачки: до коммита их держат только наши tmp-ссылки
+    pending = []
+    try:
+        if archive_file is not None:
+            archive = await run_in_threadpool(zipfile.ZipFile, archive_file.file)
+        async with AsyncSessionLocal() as db:
+            book_import = (await db.execute(select(BookImport).where(BookImport.id == import_id))).scalars().first()
+            reader = await run_in_threadpool(ManifestReader, manifest, book_import.manifest_offset or 0)
+            rows = iter(reader)
+            checkpoint = import_state(book_import)
+            yield json.dumps(checkpoint, ensure_ascii=False) + "\n"
+            while True:
+                batch = await run_in_threadpool(read_batch, rows, BULK_IMPORT_BATCH_SIZE)
+                if not batch:
+                    break
+                books, errors = await run_in_threadpool(
+                    prepare_batch, batch, archive, book_import.rows_done + 1, pending
+                )
+                book_ids = []
+                if books:
+                    book_ids = list((await db.execute(insert(Book).values(books).returning(Book.id))).scalars().all())
+                    await index_books(db, book_ids)
+                    await add_facet_counts(db, count_facets(books))
+                book_import.rows_done += len(batch)
+                book_import.manifest_offset = reader.offset
+                book_import.inserted += len(book_ids)
+                book_import.failed += len(errors)
+                if errors:
+                    stored_errors = json.loads(book_import.errors or "[]")
+                    book_import.errors = json.dumps((stored_errors + errors)[:MAX_STORED_ERRORS], ensure_ascii=False)
+                book_import.updated_at = datetime.utcnow()
+                await db.commit()
+                for stored in pending:
+                    await settle_pdf(stored)
+                pending = []
+                checkpoint = import_state(book_import)
+                if book_ids:
+                    catalog_cache.bump()
+                    for book_id, book in zip(book_ids, books):
+                        if book.get("pdf_path"):
+                            ingest_worker.submit(book_id)
+                yield json.dumps(dict(checkpoint, errors=errors), ensure_ascii=False) + "\n"
+            book_import.status = "done"
+            book_import.updated_at = datetime.utcnow()
+            await db.commit()
+            yield json.dumps(import_state(book_import), ensure_ascii=False) + "\n"
+    except (ValueError, UnicodeDecodeError, csv.Error, zipfile.BadZipFile, OSError, SQLAlchemyError) as e:
+        # незакоммиченная пачка откатилась; клиент получает последнюю сохранённую точку и продолжает с неё
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(BookImport).where(BookImport.id == import_id)
+                    .values(status="interrupted", updated_at=datetime.utcnow())
+                )
+                await db.commit()
+        except SQLAlchemyError as db_error:
+            print(f"Не удалось отметить импорт {import_id} прерванным:", db_error)
+        yield json.dumps(dict(checkpoint, status="interrupted", error=str(e)), ensure_ascii=False) + "\n"
+    finally:
+        if pending:
+            try:
+                async with AsyncSessionLocal() as db:
+                    for stored in pending:
+                        await discard_pdf(db, stored)
+            except (SQLAlchemyError, OSError) as cleanup_error:
+                print(f"Не удалось убрать файлы незавершённой пачки импорта {import_id}:", cleanup_error)
+        if archive is not None:
+            archive.close()
+
+
+@router.post("/librarian/import_books")
+async def import_books(
+    manifest: UploadFile = File(...),
+    archive: UploadFile = File(None),
+    import_id: str = Form(None),
+    db: AsyncSession = Depends(get_db),
+    current=Depends(require_role("librarian"))
+):
+    if not manifest.filename.lower().endswith((".csv", ".jsonl")):
+        raise HTTPException(status_code=400, detail="Манифест должен быть в формате CSV или JSONL.")
+    if import_id:
+        book_import = (await db.execute(select(BookImport).where(BookImport.id == import_id))).scalars().first()
+        if not book_import:
+            raise HTTPException(status_code=404, detail="Импорт не найден.")
+        if book_import.status == "done":
+            raise HTTPException(status_code=400, detail="Импорт уже завершён.")
+        # забираем импорт одним UPDATE: из двух одновременных продолжений пройдёт только одно;
+        # "running" без движения дольше BULK_IMPORT_STALE считаем брошенным упавшим воркером
+        claimed = await db.execute(
+            update(BookImport)
+            .where(
+                BookImport.id == import_id,
+                BookImport.status != "done",
+                or_(
+                    BookImport.status != "running",
+                    and_(
+                        BookImport.status == "running",
+                        BookImport.updated_at < datetime.utcnow() - timedelta(seconds=BULK_IMPORT_STALE),
+                    ),
+                ),
+            )
+            .values(status="running", updated_at=datetime.utcnow())
+        )
+        if claimed.rowcount == 0:
+            await db.rollback()
+            raise HTTPException(status_code=409, detail="Импорт уже выполняется.")
+    else:
+        book_import = BookImport(id=str(uuid4()), status="running")
+        db.add(book_import)
+    await db.commit()
+    return StreamingResponse(run_import(book_import.id, manifest, archive), media_type="application/x-ndjson")
+
+
+@router.get("/librarian/imports/{import_id}")
+async def get_import(
+    import_id: str,
+    db: AsyncSession = Depends(get_db),
+    current=Depends(require_role("librarian"))
+):
+    book_import = (await db.execute(select(BookImport).where(BookImport.id == import_id))).scalars().first()
+    if not book_import:
+        raise HTTPException(status_code=404, detail="Импорт не найден.")
+    return dict(import_state(book_import), errors=json.loads(book_import.errors or "[]"))
@@ -2,9 +2,17 @@ from fastapi import APIRouter, Depends, Body, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from dependencies import get_db, require_role
 from models import Rent, Request, Book, User, Comment
-from schemas import RentIdIn, AcceptReturnIn, BookIdIn
-import os
-from sqlalchemy import select, delete
+from schemas import RentIdIn, AcceptReturnIn, AcceptReturnsBatchIn, BookIdIn
+from search import unindex_book
+from facets import remove_book_facets
+from catalog_cache import catalog_cache
+from dashboard_cache import dashboard_cache
+from crud import lock_books, release_expired_rents, rented_book_ids
+from sqlalchemy.exc import IntegrityError
+from request_feed import request_feed
+from storage import release_pdf
+from pdf_delivery import book_file_cache
+from sqlalchemy import select, delete, update, tuple_
 from datetime import timedelta, datetime
 
 router = APIRouter()
@@ -31,6 +39,7 @@ async def librarian_cancel_rent(
         req.status = "cancelled"
     await db.delete(rent)
     await db.commit()
+    dashboard_cache.invalidate(rent.user_id)
     return {"message": "Бронь удалена"}
 
 @router.post("/librarian/extend_rent")
@@ -47,8 +56,9 @@ async def librarian_extend_rent(
     rent = (await db.execute(select(Rent).where(Rent.id == rent_id))).scalars().first()
     if not rent:
         raise HTTPException(status_code=404, detail="Аренда не найдена.")
-    rent.rented_at += timedelta(hours=hours)
+    rent.expires_at += timedelta(hours=hours)
     await db.commit()
+    dashboard_cache.invalidate(rent.user_id)
     return {"message": f"Аренда продлена на {hours} часов"}
 
 @router.post("/librarian/give_book")
@@ -73,12 +83,14 @@ async def librarian_give_book(
     if not user_book:
         raise HTTPException(status_code=404, detail="Пользователь или книга не найдены.")
     user, book = user_book
+    await lock_books(db, [book_id])
+    expired_users = await release_expired_rents(db, [book_id])
 
     existing_rent = (await db.execute(
         select(Rent).where(
             Rent.user_id == user.id,
             Rent.book_id == book_id,
-            Rent.rented_at + timedelta(hours=48) > datetime.utcnow()
+            Rent.expires_at > datetime.utcnow()
         )
     )).scalars().first()
     if existing_rent:
@@ -94,12 +106,19 @@ async def librarian_give_book(
     )).scalars().first()
     if existing_request:
         return {"message": "У пользователя уже есть активная заявка на эту книгу."}
+    if await rented_book_ids(db, [book_id]):
+        return {"message": "Книга уже выдана другому пользователю."}
 
     rent = Rent(user_id=user.id, book_id=book_id)
     db.add(rent)
     request = Request(user_id=user.id, book_id=book_id, status="approved")
     db.add(request)
-    await db.commit()
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        return {"message": "Книга уже выдана другому пользователю."}
+    dashboard_cache.invalidate(user.id, *expired_users)
     return {"message": f"Книга '{book.title}' выдана пользователю {username}"}
 
 @router.post("/librarian/accept_return")
@@ -120,8 +139,37 @@ async def librarian_accept_return(
         await db.delete(rent)
     req.status = "returned"
     await db.commit()
+    dashboard_cache.invalidate(req.user_id)
+    await request_feed.publish([req.id])
     return {"message": "Возврат книги принят"}
 
+@router.post("/librarian/accept_returns_batch")
+async def librarian_accept_returns_batch(
+    data: AcceptReturnsBatchIn,
+    db: AsyncSession = Depends(get_db),
+    current=Depends(require_role("librarian"))
+):
+    found = {
+        req.id: req
+        for req in (await db.execute(select(Request).where(Request.id.in_(data.request_ids)))).scalars().all()
+    }
+    results, accepted = [], {}
+    for request_id in data.request_ids:
+        req = found.get(request_id)
+        if request_id in accepted or not req or req.status != "return_requested":
+            results.append({"request_id": request_id, "ok": False, "detail": "Заявка не найдена или не ожидает возврата."})
+            continue
+        accepted[request_id] = req
+        results.append({"request_id": request_id, "ok": True, "status": "returned"})
+    if accepted:
+        pairs = list({(req.user_id, req.book_id) for req in accepted.values()})
+        await db.execute(delete(Rent).where(tuple_(Rent.user_id, Rent.book_id).in_(pairs)))
+        await db.execute(update(Request).where(Request.id.in_(list(accepted))).values(status="returned"))
+        await db.commit()
+        dashboard_cache.invalidate(*(user_id for user_id, _ in pairs))
+        await request_feed.publish(list(accepted))
+    return results
+
 @router.post("/librarian/delete_book")
 async def librarian_delete_book(
     data: BookIdIn,
@@ -136,8 +184,13 @@ async def librarian_delete_book(
     await db.execute(delete(Rent).where(Rent.book_id == book_id))
     await db.execute(delete(Request).where(Request.book_id == book_id))
     await db.execute(delete(Comment).where(Comment.book_id == book_id))
+    await unindex_book(db, book_id)
+    await remove_book_facets(db, book)
     await db.delete(book)
     await db.commit()
-    if book.pdf_path and os.path.exists(book.pdf_path):
-        os.remove(book.pdf_path)
+    catalog_cache.bump()
+    dashboard_cache.clear()
+    book_file_cache.invalidate(book_id)
+    if book.pdf_path:
+        await release_pdf(db, book.pdf_sha256, book.pdf_path, book.thumbnail_path)
     return {"message": "Книга удалена"}
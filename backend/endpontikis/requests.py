@@ -1,11 +1,22 @@
-from fastapi import APIRouter, Depends, Body, HTTPException
+from fastapi import APIRouter, Depends, Body, HTTPException, Query, Response, WebSocket, WebSocketDisconnect, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from dependencies import get_db, require_role
+from dependencies import get_db, get_current_user, require_role, resolve_user
+from database import AsyncSessionLocal
+from pagination import MAX_PAGE_SIZE, decode_cursor, encode_cursor
+from request_feed import open_requests_page, request_feed
 from models import Request, Rent, Book, Comment, User
-from schemas import ProcessRequestIn, ReturnRequestIn
-from crud import get_user_by_username
-from datetime import timedelta, datetime
-from sqlalchemy import select, update
+from schemas import ProcessRequestIn, ProcessRequestsBatchIn, ReturnRequestIn
+from crud import add_rating, get_user_by_username, lock_books, release_expired_rents, rented_book_ids
+from catalog_cache import catalog_cache
+from dashboard_cache import dashboard_cache
+from datetime import datetime
+from sqlalchemy import and_, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+import csv
+import io
+import json
 
 router = APIRouter()
 
@@ -18,7 +29,7 @@ async def request_rent(username: str = Body(...), book_id: int = Body(...), db:
     
     user = await get_user_by_username(db, username)
     q = select(Request, Rent).outerjoin(
-        Rent, (Rent.user_id == user.id) & (Rent.book_id == book_id) & (Rent.rented_at + timedelta(hours=48) > datetime.utcnow())
+        Rent, (Rent.user_id == user.id) & (Rent.book_id == book_id) & (Rent.expires_at > datetime.utcnow())
     ).where(
         Request.user_id == user.id,
         Request.book_id == book_id,
@@ -35,30 +46,49 @@ async def request_rent(username: str = Body(...), book_id: int = Body(...), db:
     req = Request(user_id=user.id, book_id=book_id)
     db.add(req)
     await db.commit()
+    dashboard_cache.invalidate(user.id)
+    await request_feed.publish([req.id])
     return {"message": "Заявка на аренду отправлена библиотекарю"}
 
 @router.get("/requests")
 async def get_requests(
+    response: Response,
+    limit: int = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: str = None,
     db: AsyncSession = Depends(get_db),
     current=Depends(require_role("librarian"))
 ):
-    stmt = select(Request, User, Book)\
-        .join(User, User.id == Request.user_id)\
-        .join(Book, Book.id == Request.book_id)\
-        .where(Request.status.in_(["pending", "return_requested"]))
-    result = await db.execute(stmt)
-    requests = result.all()
-    return [
-        {
-            "id": req.id,
-            "username": user.username,
-            "book_id": book.id,
-            "book_title": book.title,
-            "status": req.status,
-            "created_at": req.created_at
-        }
-        for req, user, book in requests
-    ]
+    items, next_cursor = await open_requests_page(db, limit, after)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return items
+
+@router.websocket("/ws/requests")
+async def requests_feed(websocket: WebSocket, token: str = None):
+    async with AsyncSessionLocal() as db:
+        try:
+            user = await resolve_user(token, db)
+        except HTTPException:
+            user = None
+    if not user or user.role != "librarian":
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    await request_feed.connect(websocket)
+    try:
+        await request_feed.send_snapshot(websocket)
+        while True:
+            try:
+                data = json.loads(await websocket.receive_text())
+            except ValueError:
+                continue
+            if isinstance(data, dict) and data.get("type") == "snapshot":
+                await request_feed.send_snapshot(websocket, data.get("after"))
+    except WebSocketDisconnect:
+        pass
+    except HTTPException as e:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=str(e.detail))
+    finally:
+        request_feed.disconnect(websocket)
 
 
 @router.post("/process_request")
@@ -75,22 +105,112 @@ async def process_request(
     req = (await db.execute(select(Request).where(Request.id == data.request_id))).scalars().first()
     if not req or req.status != "pending":
         raise HTTPException(status_code=404, detail="Заявка не найдена или уже обработана.")
+    await lock_books(db, [req.book_id])
+    req = (await db.execute(
+        select(Request).where(Request.id == data.request_id)
+        .with_for_update().execution_options(populate_existing=True)
+    )).scalars().first()
+    if not req or req.status != "pending":
+        raise HTTPException(status_code=409, detail="Заявка уже обработана другим библиотекарем.")
     if data.approve:
-        await db.execute(
+        expired_users = await release_expired_rents(db, [req.book_id])
+        if await rented_book_ids(db, [req.book_id]):
+            raise HTTPException(status_code=409, detail="Книга уже выдана.")
+        declined = (await db.execute(
             update(Request)
             .where(Request.book_id == req.book_id, Request.status == "pending", Request.id != req.id)
             .values(status="declined")
-        )
+            .returning(Request.id, Request.user_id)
+        )).all()
+        declined_ids = [request_id for request_id, _ in declined]
         req.status = "approved"
         rent = Rent(user_id=req.user_id, book_id=req.book_id)
         db.add(rent)
-        await db.commit()
+        try:
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
+            raise HTTPException(status_code=409, detail="Книга уже выдана.")
+        dashboard_cache.invalidate(req.user_id, *expired_users, *(user_id for _, user_id in declined))
+        await request_feed.publish([req.id, *declined_ids])
         return {"message": "Заявка одобрена, остальные заявки отклонены"}
     else:
         req.status = "declined"
         await db.commit()
+        dashboard_cache.invalidate(req.user_id)
+        await request_feed.publish([req.id])
         return {"message": "Заявка отклонена"}
 
+@router.post("/process_requests_batch")
+async def process_requests_batch(
+    data: ProcessRequestsBatchIn,
+    db: AsyncSession = Depends(get_db),
+    current=Depends(require_role("librarian"))
+):
+    ids = [d.request_id for d in data.decisions]
+    book_ids = (await db.execute(select(Request.book_id).where(Request.id.in_(ids)))).scalars().all()
+    await lock_books(db, book_ids)
+    affected_users = set(await release_expired_rents(db, book_ids))
+    rented = await rented_book_ids(db, book_ids)
+    found = {
+        req.id: req
+        for req in (await db.execute(
+            select(Request).where(Request.id.in_(ids))
+            .with_for_update().execution_options(populate_existing=True)
+        )).scalars().all()
+    }
+    results = []
+    seen, approved_ids, declined_ids, approved_books = set(), [], [], {}
+    for decision in data.decisions:
+        req = found.get(decision.request_id)
+        if decision.request_id in seen:
+            results.append({"request_id": decision.request_id, "ok": False, "detail": "Заявка указана повторно."})
+            continue
+        seen.add(decision.request_id)
+        if not req or req.status != "pending":
+            results.append({"request_id": decision.request_id, "ok": False, "detail": "Заявка не найдена или уже обработана."})
+            continue
+        if not decision.approve:
+            declined_ids.append(req.id)
+            results.append({"request_id": req.id, "ok": True, "status": "declined"})
+        elif req.book_id in rented:
+            results.append({"request_id": req.id, "ok": False, "detail": "Книга уже выдана."})
+        elif req.book_id in approved_books:
+            declined_ids.append(req.id)
+            results.append({
+                "request_id": req.id, "ok": False, "status": "declined",
+                "detail": f"Книга уже выдана по заявке {approved_books[req.book_id].id}."
+            })
+        else:
+            approved_books[req.book_id] = req
+            approved_ids.append(req.id)
+            results.append({"request_id": req.id, "ok": True, "status": "approved"})
+    changed = approved_ids + declined_ids
+    affected_users.update(found[request_id].user_id for request_id in changed)
+    if declined_ids:
+        await db.execute(update(Request).where(Request.id.in_(declined_ids)).values(status="declined"))
+    if approved_ids:
+        await db.execute(update(Request).where(Request.id.in_(approved_ids)).values(status="approved"))
+        auto_declined = (await db.execute(
+            update(Request)
+            .where(Request.book_id.in_(list(approved_books)), Request.status == "pending")
+            .values(status="declined")
+            .returning(Request.id, Request.user_id)
+        )).all()
+        changed += [request_id for request_id, _ in auto_declined]
+        affected_users.update(user_id for _, user_id in auto_declined)
+        await db.execute(insert(Rent), [
+            {"user_id": req.user_id, "book_id": req.book_id} for req in approved_books.values()
+        ])
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="Одна из книг уже выдана, повторите запрос.")
+    dashboard_cache.invalidate(*affected_users)
+    await request_feed.publish(changed)
+    return results
+
 @router.get("/my_requests")
 async def my_requests(username: str, db: AsyncSession = Depends(get_db)):
     if not isinstance(username, str):
@@ -118,13 +238,38 @@ async def my_requests(username: str, db: AsyncSession = Depends(get_db)):
     ]
 
 @router.get("/comments/{book_id}")
-async def get_comments(book_id: int, db: AsyncSession = Depends(get_db)):
+async def get_comments(
+    book_id: int,
+    response: Response,
+    limit: int = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: str = None,
+    db: AsyncSession = Depends(get_db)
+):
     if not isinstance(book_id, int):
         raise HTTPException(status_code=400, detail="ID книги должен быть целым числом.")
     
-    stmt = select(Comment, User).join(User, User.id == Comment.user_id).where(Comment.book_id == book_id).order_by(Comment.created_at.desc())
+    stmt = select(Comment, User).join(User, User.id == Comment.user_id).where(Comment.book_id == book_id)\
+        .order_by(Comment.created_at.desc(), Comment.id.desc())
+    if after:
+        created_at, comment_id = decode_cursor(after, 2)
+        try:
+            created_at = datetime.fromisoformat(created_at)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Некорректный курсор.")
+        if not isinstance(comment_id, int):
+            raise HTTPException(status_code=400, detail="Некорректный курсор.")
+        stmt = stmt.where(or_(
+            Comment.created_at < created_at,
+            and_(Comment.created_at == created_at, Comment.id < comment_id)
+        ))
+    if limit:
+        stmt = stmt.limit(limit + 1)
     result = await db.execute(stmt)
     comments = result.all()
+    if limit and len(comments) > limit:
+        comments = comments[:limit]
+        last = comments[-1][0]
+        response.headers["X-Next-Cursor"] = encode_cursor(last.created_at.isoformat(), last.id)
     return [
         {
             "username": user.username,
@@ -153,22 +298,93 @@ async def request_return(data: ReturnRequestIn, db: AsyncSession = Depends(get_d
         raise HTTPException(status_code=400, detail="Нельзя вернуть эту книгу.")
     comment = Comment(user_id=user.id, book_id=req.book_id, text=data.text, rating=data.rating)
     db.add(comment)
+    await add_rating(db, req.book_id, data.rating)
     req.status = "return_requested"
     await db.commit()
+    catalog_cache.bump()
+    dashboard_cache.invalidate(user.id)
+    await request_feed.publish([req.id])
     return {"message": "Запрос на возврат отправлен библиотекарю"}
 
+EXPORT_BATCH_SIZE = 1000
+RENT_EXPORT_COLUMNS = ["rent_id", "username", "book_title", "book_id", "rented_at", "expires_at"]
+
+
+def active_rents_query():
+    return select(Rent.id, User.username, Book.title, Book.id, Rent.rented_at, Rent.expires_at)\
+        .join(User, User.id == Rent.user_id)\
+        .join(Book, Book.id == Rent.book_id)\
+        .where(Rent.expires_at > datetime.utcnow())\
+        .order_by(Rent.id)
+
+
+def rent_row(row):
+    return dict(zip(RENT_EXPORT_COLUMNS, row))
+
+
+@router.get("/rented_books")
+async def get_rented_books(db: AsyncSession = Depends(get_db), current=Depends(get_current_user)):
+    # читателю каталога нужно только, какие книги заняты и какие из них у него; чужие аренды не отдаём
+    now = datetime.utcnow()
+    return {
+        "book_ids": sorted(await rented_book_ids(db, active_at=now)),
+        "my_book_ids": sorted(await rented_book_ids(db, user_id=current.id, active_at=now)),
+    }
+
+
 @router.get("/active_rents")
-async def get_active_rents(db: AsyncSession = Depends(get_db)):
-    stmt = select(Rent, User, Book).join(User, User.id == Rent.user_id).join(Book, Book.id == Rent.book_id)
-    result = await db.execute(stmt)
-    rents = result.all()
-    return [
-        {
-            "rent_id": rent.id,
-            "username": user.username,
-            "book_title": book.title,
-            "book_id": book.id,
-            "rented_at": rent.rented_at,
-        }
-        for rent, user, book in rents
-    ]
+async def get_active_rents(
+    response: Response,
+    limit: int = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: str = None,
+    db: AsyncSession = Depends(get_db),
+    current=Depends(require_role("librarian"))
+):
+    stmt = active_rents_query()
+    if after:
+        (rent_id,) = decode_cursor(after, 1)
+        if not isinstance(rent_id, int):
+            raise HTTPException(status_code=400, detail="Некорректный курсор.")
+        stmt = stmt.where(Rent.id > rent_id)
+    if limit:
+        stmt = stmt.limit(limit + 1)
+    rows = (await db.execute(stmt)).all()
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(rows[-1][0])
+    return [rent_row(row) for row in rows]
+
+
+async def export_rents(fmt: str):
+    # отдельная сессия: поток живёт дольше зависимости get_db, строки читаются серверным курсором
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(active_rents_query().execution_options(yield_per=EXPORT_BATCH_SIZE))
+        if fmt == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(RENT_EXPORT_COLUMNS)
+            async for rows in result.partitions():
+                writer.writerows(
+                    [value.isoformat() if isinstance(value, datetime) else value for value in row] for row in rows
+                )
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            yield buffer.getvalue()
+        else:
+            async for rows in result.partitions():
+                yield "".join(json.dumps(jsonable_encoder(rent_row(row)), ensure_ascii=False) + "\n" for row in rows)
+
+
+@router.get("/active_rents/export")
+async def export_active_rents(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    current=Depends(require_role("librarian"))
+):
+    if format == "csv":
+        return StreamingResponse(
+            export_rents("csv"),
+            media_type="text/csv; charset=utf-8",
+            headers={"Content-Disposition": 'attachment; filename="active_rents.csv"'},
+        )
+    return StreamingResponse(export_rents("ndjson"), media_type="application/x-ndjson")
@@ -1,9 +1,10 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
-from dependencies import get_db, require_roles
-from models import User, Rent, Book
+from dependencies import get_db, get_current_user, require_roles
+from models import User, Rent, Book, Request, Comment
 from crud import get_user_by_username
-from datetime import datetime, timedelta
+from dashboard_cache import dashboard_cache
+from datetime import datetime
 from sqlalchemy import select
 
 router = APIRouter()
@@ -17,7 +18,7 @@ async def get_profile(username: str, db: AsyncSession = Depends(get_db)):
         .join(Book, Book.id == Rent.book_id)
         .where(
             Rent.user_id == user.id,
-            Rent.rented_at + timedelta(hours=48) > now
+            Rent.expires_at > now
         )
     )
     result = await db.execute(stmt)
@@ -40,6 +41,73 @@ async def get_profile(username: str, db: AsyncSession = Depends(get_db)):
     }
 
 
+@router.get("/me/dashboard")
+async def get_dashboard(db: AsyncSession = Depends(get_db), user=Depends(get_current_user)):
+    cached = dashboard_cache.get(user.id)
+    if cached is not None:
+        return cached
+    generation = dashboard_cache.generation
+    now = datetime.utcnow()
+    my_rating = (
+        select(Comment.rating)
+        .where(Comment.user_id == user.id, Comment.book_id == Book.id)
+        .order_by(Comment.created_at.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    stmt = (
+        select(Request, Book, Rent.rented_at, Rent.expires_at, my_rating.label("my_rating"))
+        .join(Book, Book.id == Request.book_id)
+        .outerjoin(
+            Rent,
+            (Rent.user_id == Request.user_id) & (Rent.book_id == Request.book_id) & (Rent.expires_at > now)
+        )
+        .where(Request.user_id == user.id)
+        .order_by(Request.created_at.desc(), Request.id.desc())
+    )
+    rows = (await db.execute(stmt)).all()
+    requests, active_rents, rented = [], [], set()
+    for req, book, rented_at, expires_at, rating in rows:
+        item = {
+            "id": book.id,
+            "title": book.title,
+            "description": book.description,
+            "cover_url": book.cover_url,
+            "author": book.author,
+            "genre": book.genre,
+            "publisher": book.publisher,
+            "rating_count": book.rating_count,
+            "rating_avg": book.rating_avg,
+            "my_rating": rating,
+        }
+        requests.append({
+            "id": req.id,
+            "book_id": book.id,
+            "book_title": book.title,
+            "status": req.status,
+            "created_at": req.created_at,
+            "cover_url": book.cover_url,
+            "author": book.author,
+            "genre": book.genre,
+            "publisher": book.publisher,
+            "description": book.description,
+            "my_rating": rating,
+        })
+        if expires_at and book.id not in rented:
+            rented.add(book.id)
+            active_rents.append(dict(item, rented_at=rented_at, expires_at=expires_at))
+    dashboard = {
+        "username": user.username,
+        "role": user.role,
+        "active_rents": active_rents,
+        "requests": requests,
+    }
+    # запись живёт не дольше ближайшего окончания аренды
+    max_age = min(((r["expires_at"] - now).total_seconds() for r in active_rents), default=None)
+    dashboard_cache.put(user.id, generation, dashboard, max_age)
+    return dashboard
+
+
 @router.get("/users")
 async def get_users(
     db: AsyncSession = Depends(get_db),
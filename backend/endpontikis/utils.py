@@ -3,6 +3,9 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from dependencies import get_db
 from models import User, Book, Rent, Request
 from sqlalchemy import select, delete
+from sqlalchemy.exc import IntegrityError
+from crud import lock_books
+from dashboard_cache import dashboard_cache
 
 router = APIRouter()
 
@@ -37,11 +40,14 @@ async def transfer_book(
 
     if not from_user or not to_user or not book:
         raise HTTPException(status_code=404, detail="Пользователь или книга не найдены.")
+    await lock_books(db, [book_id])
 
     rent_result = await db.execute(select(Rent).where(Rent.user_id == from_user.id, Rent.book_id == book_id))
     rent = rent_result.scalars().first()
     if rent:
         await db.delete(rent)
+        # старая аренда должна исчезнуть до вставки новой из-за уникального индекса по book_id
+        await db.flush()
     req_result = await db.execute(select(Request).where(Request.user_id == from_user.id, Request.book_id == book_id, Request.status == "approved"))
     req = req_result.scalars().first()
     if req:
@@ -51,6 +57,11 @@ async def transfer_book(
     db.add(new_rent)
     new_req = Request(user_id=to_user.id, book_id=book_id, status="approved")
     db.add(new_req)
-    await db.commit()
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="Книга выдана другому пользователю.")
+    dashboard_cache.invalidate(from_user.id, to_user.id)
     return {"message": f"Книга '{book.title}' передана от {from_username} к {to_username}"}
 
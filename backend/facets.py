@@ -0,0 +1,77 @@
+from collections import Counter
+from sqlalchemy import String, delete, func, literal, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import Book, BookFacet
+
+FACETS = ("author", "genre", "publisher")
+
+
+def _insert(db):
+    return pg_insert if db.bind.dialect.name == "postgresql" else sqlite_insert
+
+
+async def init_facets(conn):
+    has_facets = (await conn.execute(select(BookFacet.facet).limit(1))).first()
+    if has_facets:
+        return
+    for facet in FACETS:
+        column = getattr(Book, facet)
+        await conn.execute(
+            BookFacet.__table__.insert().from_select(
+                ["facet", "value", "count"],
+                select(literal(facet, String), column, func.count())
+                .where(column.isnot(None))
+                .group_by(column),
+            )
+        )
+
+
+async def add_facet_counts(db, counts):
+    for (facet, value), amount in counts.items():
+        stmt = _insert(db)(BookFacet).values(facet=facet, value=value, count=amount)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[BookFacet.facet, BookFacet.value],
+            set_={"count": BookFacet.count + stmt.excluded.count},
+        )
+        await db.execute(stmt)
+
+
+def count_facets(books):
+    counts = Counter()
+    for book in books:
+        for facet in FACETS:
+            value = book[facet] if isinstance(book, dict) else getattr(book, facet)
+            if value is not None:
+                counts[(facet, value)] += 1
+    return counts
+
+
+async def add_book_facets(db, book):
+    await add_facet_counts(db, count_facets([book]))
+
+
+async def remove_book_facets(db, book):
+    for facet in FACETS:
+        value = getattr(book, facet)
+        if value is None:
+            continue
+        await db.execute(
+            update(BookFacet)
+            .where(BookFacet.facet == facet, BookFacet.value == value)
+            .values(count=BookFacet.count - 1)
+        )
+    await db.execute(delete(BookFacet).where(BookFacet.count <= 0))
+
+
+async def get_facet_counts(db, limit: int):
+    result = {}
+    for facet in FACETS:
+        rows = (await db.execute(
+            select(BookFacet.value, BookFacet.count)
+            .where(BookFacet.facet == facet, BookFacet.count > 0)
+            .order_by(BookFacet.count.desc(), BookFacet.value)
+            .limit(limit)
+        )).all()
+        result[facet] = [{"value": value, "count": count} for value, count in rows]
+    return result
@@ -0,0 +1,155 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import and_, or_, select, update
+from database import AsyncSessionLocal
+from models import Book
+from catalog_cache import catalog_cache
+from search import index_book
+
+# пул на каждый процесс uvicorn: по умолчанию ядра хоста делятся между WEB_CONCURRENCY воркерами
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "0")) or max(
+    (os.cpu_count() or 1) // max(int(os.getenv("WEB_CONCURRENCY", "1")), 1), 1
+)
+# сколько секунд книга считается занятой воркером; дольше - значит, он упал, и книгу берёт другой
+INGEST_LEASE = int(os.getenv("INGEST_LEASE", "600"))
+INGEST_MAX_TEXT_CHARS = int(os.getenv("INGEST_MAX_TEXT_CHARS", "1000000"))
+THUMBNAIL_WIDTH = int(os.getenv("THUMBNAIL_WIDTH", "300"))
+
+
+def thumbnail_path_for(pdf_path: str) -> str:
+    return os.path.splitext(pdf_path)[0] + ".png"
+
+
+def extract_pdf(pdf_path: str, thumbnail_path: str) -> dict:
+    # выполняется в отдельном процессе, поэтому импорт здесь
+    import pymupdf
+
+    with pymupdf.open(pdf_path) as doc:
+        if doc.needs_pass:
+            raise ValueError("PDF защищён паролем")
+        if doc.page_count == 0:
+            raise ValueError("В PDF нет страниц")
+        parts = []
+        size = 0
+        for page in doc:
+            if size >= INGEST_MAX_TEXT_CHARS:
+                break
+            page_text = page.get_text()
+            parts.append(page_text)
+            size += len(page_text)
+        first_page = doc[0]
+        zoom = THUMBNAIL_WIDTH / first_page.rect.width
+        first_page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom)).save(thumbnail_path)
+        return {
+            "page_count": doc.page_count,
+            "content_text": "".join(parts)[:INGEST_MAX_TEXT_CHARS],
+            "thumbnail_path": thumbnail_path,
+        }
+
+
+class IngestWorker:
+    def __init__(self, workers: int = INGEST_WORKERS, lease: int = INGEST_LEASE):
+        self.workers = workers
+        self.lease = lease
+        self.pool = None
+        self.queue: asyncio.Queue = None
+        self.tasks = []
+
+    async def start(self):
+        self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        self.queue = asyncio.Queue()
+        self.tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(select(Book.id).where(self.claimable()).order_by(Book.id))
+            for book_id in result.scalars().all():
+                self.submit(book_id)
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        if self.pool:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+    def claimable(self):
+        # книги, которые сейчас обрабатывает живой воркер (в том числе в другом процессе), не трогаем
+        return or_(
+            Book.ingest_status == "pending",
+            and_(
+                Book.ingest_status == "processing",
+                or_(
+                    Book.ingest_claimed_at.is_(None),
+                    Book.ingest_claimed_at < datetime.utcnow() - timedelta(seconds=self.lease),
+                ),
+            ),
+        )
+
+    async def claim(self, db, book_id: int) -> bool:
+        # строку, которую в этот момент забирает другой воркер, пропускаем, а не ждём
+        claimed = (await db.execute(
+            select(Book.id).where(Book.id == book_id, self.claimable()).with_for_update(skip_locked=True)
+        )).scalar()
+        if claimed is not None:
+            await db.execute(
+                update(Book).where(Book.id == book_id)
+                .values(ingest_status="processing", ingest_claimed_at=datetime.utcnow())
+            )
+        await db.commit()
+        return claimed is not None
+
+    def submit(self, book_id: int):
+        if self.queue is not None:
+            self.queue.put_nowait(book_id)
+
+    async def _run(self):
+        while True:
+            book_id = await self.queue.get()
+            try:
+                await self.ingest(book_id)
+            except Exception as e:
+                print(f"Ошибка обработки книги {book_id}:", e)
+            finally:
+                self.queue.task_done()
+
+    async def ingest(self, book_id: int):
+        async with AsyncSessionLocal() as db:
+            if not await self.claim(db, book_id):
+                return
+            book = (await db.execute(select(Book).where(Book.id == book_id))).scalars().first()
+            if not book:
+                return
+            done = (await db.execute(
+                select(Book.page_count, Book.thumbnail_path, Book.content_text).where(
+                    Book.pdf_sha256 == book.pdf_sha256,
+                    Book.ingest_status == "ready",
+                    Book.id != book.id,
+                ).limit(1)
+            )).first() if book.pdf_sha256 else None
+            if done:
+                extracted = dict(done._mapping)
+            else:
+                try:
+                    extracted = await asyncio.get_running_loop().run_in_executor(
+                        self.pool, extract_pdf, book.pdf_path, thumbnail_path_for(book.pdf_path)
+                    )
+                except Exception as e:
+                    book.ingest_status = "failed"
+                    book.ingest_error = str(e)[:512]
+                    await db.commit()
+                    return
+            book.page_count = extracted["page_count"]
+            book.thumbnail_path = extracted["thumbnail_path"]
+            book.content_text = extracted["content_text"]
+            book.ingest_status = "ready"
+            book.ingest_error = None
+            await db.flush()
+            await index_book(db, book, extracted["content_text"])
+            await db.commit()
+        catalog_cache.bump()
+
+
+ingest_worker = IngestWorker()
@@ -0,0 +1,151 @@
+import asyncio
+import os
+import smtplib
+from email.mime.text import MIMEText
+from starlette.concurrency import run_in_threadpool
+
+MAIL_TRANSPORT = os.getenv("MAIL_TRANSPORT", "smtp")
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "1") == "1"
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "30"))
+SMTP_IDLE_TIMEOUT = float(os.getenv("SMTP_IDLE_TIMEOUT", "60"))
+MAIL_QUEUE_SIZE = int(os.getenv("MAIL_QUEUE_SIZE", "1000"))
+MAIL_MAX_ATTEMPTS = int(os.getenv("MAIL_MAX_ATTEMPTS", "5"))
+MAIL_RETRY_DELAY = float(os.getenv("MAIL_RETRY_DELAY", "2"))
+
+
+class SMTPTransport:
+    # одно соединение на все письма: STARTTLS и логин только при (пере)подключении
+    def __init__(self, host: str = SMTP_HOST, port: int = SMTP_PORT, user: str = None, password: str = None,
+                 starttls: bool = SMTP_STARTTLS, timeout: float = SMTP_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.user = user if user is not None else os.environ.get("GMAIL_USER")
+        self.password = password if password is not None else os.environ.get("GMAIL_PASS")
+        self.starttls = starttls
+        self.timeout = timeout
+        self.server = None
+
+    @property
+    def sender(self):
+        return os.environ.get("MAIL_FROM") or self.user
+
+    def connect(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            server.ehlo()
+            if self.starttls:
+                server.starttls()
+                server.ehlo()
+            if self.user and self.password:
+                server.login(self.user, self.password)
+        except Exception:
+            server.close()
+            raise
+        self.server = server
+
+    def send(self, msg):
+        if not self.sender:
+            raise RuntimeError("GMAIL_USER or MAIL_FROM not set in environment")
+        if self.server is None:
+            self.connect()
+        del msg["From"]
+        msg["From"] = self.sender
+        self.server.sendmail(self.sender, [msg["To"]], msg.as_string())
+
+    def close(self):
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except smtplib.SMTPException:
+            self.server.close()
+        except OSError:
+            pass
+        self.server = None
+
+
+class ConsoleTransport:
+    def send(self, msg):
+        print(f"Письмо для {msg['To']}: {msg['Subject']}\n{msg.get_payload(decode=True).decode()}")
+
+    def close(self):
+        pass
+
+
+MAIL_TRANSPORTS = {
+    "smtp": SMTPTransport,
+    "console": ConsoleTransport,
+}
+
+
+class Mailer:
+    def __init__(self, transport=None, max_attempts: int = MAIL_MAX_ATTEMPTS, retry_delay: float = MAIL_RETRY_DELAY,
+                 queue_size: int = MAIL_QUEUE_SIZE, idle_timeout: float = SMTP_IDLE_TIMEOUT):
+        self.transport = transport
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.queue_size = queue_size
+        self.idle_timeout = idle_timeout
+        self.queue: asyncio.Queue = None
+        self.task = None
+        self.sent = 0
+        self.failed = 0
+
+    async def start(self):
+        if self.transport is None:
+            self.transport = MAIL_TRANSPORTS[MAIL_TRANSPORT]()
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 5):
+        if self.task:
+            try:
+                await asyncio.wait_for(self.queue.join(), timeout)
+            except asyncio.TimeoutError:
+                print(f"Не отправлено писем при остановке: {self.queue.qsize()}")
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        if self.transport:
+            await run_in_threadpool(self.transport.close)
+
+    def send(self, to: str, subject: str, body: str) -> bool:
+        if self.queue is None or self.queue.full():
+            return False
+        msg = MIMEText(body)
+        msg["Subject"] = subject
+        msg["To"] = to
+        self.queue.put_nowait(msg)
+        return True
+
+    async def _run(self):
+        while True:
+            try:
+                msg = await asyncio.wait_for(self.queue.get(), self.idle_timeout)
+            except asyncio.TimeoutError:
+                # почтовые серверы сами рвут простаивающие соединения, закрываем первыми
+                await run_in_threadpool(self.transport.close)
+                continue
+            try:
+                await self.deliver(msg)
+            finally:
+                self.queue.task_done()
+
+    async def deliver(self, msg):
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                await run_in_threadpool(self.transport.send, msg)
+                self.sent += 1
+                return True
+            except Exception as e:
+                await run_in_threadpool(self.transport.close)
+                if attempt == self.max_attempts:
+                    self.failed += 1
+                    print(f"Ошибка при отправке email для {msg['To']}, попыток: {attempt}:", e)
+                    return False
+                await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+
+
+mailer = Mailer()
@@ -1,7 +1,15 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from database import init_db
-from endpontikis import auth, users, books, admin, librarian, requests, chat, utils
+from ingest import ingest_worker
+from rent_sweeper import rent_sweeper
+from auth import password_hasher
+from reset_tokens import reset_token_store
+from mailer import mailer
+from chat_history import chat_history
+from endpontikis import auth, users, books, admin, librarian, requests, chat, utils, imports
+from endpontikis.chat import user_chat_manager
+from request_feed import request_feed
 from dotenv import load_dotenv
 
 app = FastAPI()
@@ -9,6 +17,24 @@ app = FastAPI()
 @app.on_event("startup")
 async def on_startup():
     await init_db()
+    await ingest_worker.start()
+    await rent_sweeper.start()
+    await reset_token_store.start()
+    await mailer.start()
+    await chat_history.start()
+    await user_chat_manager.start()
+    await request_feed.start()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await request_feed.stop()
+    await user_chat_manager.stop()
+    await chat_history.stop()
+    await mailer.stop()
+    await reset_token_store.stop()
+    await rent_sweeper.stop()
+    await ingest_worker.stop()
+    password_hasher.shutdown()
 
 load_dotenv()
 
@@ -17,6 +43,7 @@ app.add_middleware(
     allow_origins=["http://localhost:3000"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "Content-Range", "Accept-Ranges"],
 )
 
 app.include_router(auth.router)
@@ -27,3 +54,4 @@ app.include_router(librarian.router)
 app.include_router(requests.router)
 app.include_router(chat.router)
 app.include_router(utils.router)
+app.include_router(imports.router)
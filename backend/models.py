@@ -1,10 +1,17 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, Float, ForeignKey, Text, Index, case, cast, null, text
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import column_property, deferred
 from datetime import datetime, timedelta
 from sqlalchemy.ext.declarative import declarative_base
 
 
 Base = declarative_base()
 
+RENT_DURATION = timedelta(hours=48)
+
+def rent_expiry():
+    return datetime.utcnow() + RENT_DURATION
+
 
 class User(Base):
     __tablename__ = 'users'
@@ -14,6 +21,13 @@ class User(Base):
     role = Column(String, default="reader")
     email = Column(String, unique=True, index=True)
 
+class PasswordResetToken(Base):
+    __tablename__ = "password_reset_tokens"
+    # храним только sha256 токена, сам токен есть лишь в письме
+    token_hash = Column(String, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
 class Book(Base):
     __tablename__ = "books"
     id = Column(Integer, primary_key=True, index=True)
@@ -24,6 +38,42 @@ class Book(Base):
     publisher = Column(String)
     cover_url = Column(String)
     pdf_path = Column(String)
+    pdf_sha256 = Column(String, index=True)
+    pdf_size = Column(Integer)
+    ingest_status = Column(String, default="pending", index=True)
+    # когда воркер взял книгу в обработку; просроченную аренду подхватит другой воркер
+    ingest_claimed_at = Column(DateTime)
+    ingest_error = Column(String)
+    page_count = Column(Integer)
+    thumbnail_path = Column(String)
+    content_text = deferred(Column(Text))
+    search_vector = deferred(Column(TSVECTOR().with_variant(Text(), "sqlite")))
+    # агрегаты оценок из отзывов, обновляются вместе с таблицей comments
+    rating_count = Column(Integer, default=0, server_default="0", nullable=False)
+    rating_sum = Column(Integer, default=0, server_default="0", nullable=False)
+    rating_avg = column_property(
+        case((rating_count > 0, cast(rating_sum, Float) / rating_count), else_=null())
+    )
+
+class BookFacet(Base):
+    __tablename__ = "book_facets"
+    facet = Column(String, primary_key=True)
+    value = Column(String, primary_key=True)
+    count = Column(Integer, default=0, nullable=False)
+    __table_args__ = (Index("ix_book_facets_facet_count", "facet", "count"),)
+
+class BookImport(Base):
+    __tablename__ = "book_imports"
+    id = Column(String, primary_key=True)
+    status = Column(String, default="running")
+    rows_done = Column(Integer, default=0)
+    # байтовое смещение в манифесте после rows_done строк
+    manifest_offset = Column(Integer, default=0)
+    inserted = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    errors = Column(Text, default="[]")
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
 
 class Rent(Base):
     __tablename__ = "rents"
@@ -31,6 +81,11 @@ class Rent(Base):
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
     book_id = Column(Integer, ForeignKey("books.id", ondelete="CASCADE"))
     rented_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, default=rent_expiry, index=True, nullable=False)
+    __table_args__ = (
+        Index("ix_rents_user_book", "user_id", "book_id"),
+        Index("uq_rents_book_id", "book_id", unique=True),
+    )
 
 class Request(Base):
     __tablename__ = "requests"
@@ -39,6 +94,20 @@ class Request(Base):
     book_id = Column(Integer, ForeignKey("books.id", ondelete="CASCADE"))
     status = Column(String, default="pending")
     created_at = Column(DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        Index("ix_requests_user_book_status", "user_id", "book_id", "status"),
+        Index("ix_requests_book_id", "book_id"),
+        Index(
+            "ix_requests_pending_book", "book_id",
+            postgresql_where=text("status = 'pending'"),
+            sqlite_where=text("status = 'pending'"),
+        ),
+        Index(
+            "ix_requests_open_created", "created_at", "id",
+            postgresql_where=text("status IN ('pending', 'return_requested')"),
+            sqlite_where=text("status IN ('pending', 'return_requested')"),
+        ),
+    )
 
 class Comment(Base):
     __tablename__ = "comments"
@@ -48,4 +117,28 @@ class Comment(Base):
     text = Column(String)
     rating = Column(Integer)
     created_at = Column(DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        Index("ix_comments_book_created", "book_id", created_at.desc(), id.desc()),
+        Index("ix_comments_user_id", "user_id"),
+    )
 
+
+class ChatMessage(Base):
+    __tablename__ = "chat_messages"
+    id = Column(Integer, primary_key=True)
+    # пара имён в фиксированном порядке: вся переписка двух пользователей идёт подряд по одному индексу
+    conversation = Column(String, nullable=False)
+    sender = Column(String, nullable=False)
+    recipient = Column(String, nullable=False)
+    type = Column(String, nullable=False)
+    payload = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    delivered_at = Column(DateTime)
+    __table_args__ = (
+        Index("ix_chat_messages_conversation_id", "conversation", "id"),
+        Index(
+            "ix_chat_messages_undelivered", "recipient", "id",
+            postgresql_where=text("delivered_at IS NULL"),
+            sqlite_where=text("delivered_at IS NULL"),
+        ),
+    )
@@ -0,0 +1,21 @@
+import base64
+import json
+from fastapi import HTTPException
+
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(*values):
+    raw = json.dumps(values, default=str, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Некорректный курсор.")
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=400, detail="Некорректный курсор.")
+    return values
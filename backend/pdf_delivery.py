@@ -0,0 +1,210 @@
+import base64
+import hashlib
+import os
+import time
+from collections import OrderedDict, namedtuple
+from urllib.parse import quote, urlsplit
+import anyio
+from fastapi import HTTPException, Request
+from fastapi.responses import RedirectResponse, Response
+from sqlalchemy import select
+from starlette.concurrency import run_in_threadpool
+from http_cache import etag_matches, http_date, not_modified_since
+from models import Book
+from storage import BOOKS_DIR
+
+BOOK_FILE_CACHE_SIZE = int(os.getenv("BOOK_FILE_CACHE_SIZE", "4096"))
+# сколько секунд верить, что у книги тот же файл: другой воркер мог заменить его, не сбросив наш кэш
+BOOK_FILE_CACHE_TTL = float(os.getenv("BOOK_FILE_CACHE_TTL", "30"))
+# app - файл отдаёт сам python; accel / sendfile / signed - передача уходит фронт-прокси
+PDF_DELIVERY = os.getenv("PDF_DELIVERY", "app")
+PDF_ACCEL_PREFIX = os.getenv("PDF_ACCEL_PREFIX", "/protected-books")
+PDF_SIGNED_BASE_URL = os.getenv("PDF_SIGNED_BASE_URL", "/signed-books")
+PDF_SIGNED_URL_SECRET = os.getenv("PDF_SIGNED_URL_SECRET", "")
+PDF_SIGNED_URL_TTL = int(os.getenv("PDF_SIGNED_URL_TTL", "300"))
+
+BookFile = namedtuple("BookFile", ["path", "size", "etag", "mtime"])
+
+
+class BookFileCache:
+    def __init__(self, max_entries: int = BOOK_FILE_CACHE_SIZE, ttl: float = BOOK_FILE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries: OrderedDict = OrderedDict()
+
+    def get(self, book_id: int):
+        entry = self.entries.get(book_id)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self.entries[book_id]
+            return None
+        self.entries.move_to_end(book_id)
+        return entry[1]
+
+    def put(self, book_id: int, entry: BookFile):
+        if self.ttl <= 0:
+            return
+        self.entries[book_id] = (time.monotonic() + self.ttl, entry)
+        self.entries.move_to_end(book_id)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, book_id: int):
+        self.entries.pop(book_id, None)
+
+
+book_file_cache = BookFileCache()
+
+
+async def get_book_file(db, book_id: int) -> BookFile:
+    entry = book_file_cache.get(book_id)
+    if entry is not None:
+        # файл могли перезаписать или удалить: размер и время изменения должны совпасть с закэшированными
+        try:
+            stat = await run_in_threadpool(os.stat, entry.path)
+        except OSError:
+            stat = None
+        if stat is not None and stat.st_size == entry.size and stat.st_mtime == entry.mtime:
+            return entry
+        book_file_cache.invalidate(book_id)
+    row = (await db.execute(select(Book.pdf_path, Book.pdf_sha256).where(Book.id == book_id))).first()
+    if not row or not row.pdf_path:
+        raise HTTPException(status_code=404, detail="Файл книги не найден.")
+    try:
+        stat = await run_in_threadpool(os.stat, row.pdf_path)
+    except OSError:
+        raise HTTPException(status_code=404, detail="Файл книги не найден.")
+    etag = f'"{row.pdf_sha256}"' if row.pdf_sha256 else f'"{stat.st_size:x}-{int(stat.st_mtime):x}"'
+    entry = BookFile(row.pdf_path, stat.st_size, etag, stat.st_mtime)
+    book_file_cache.put(book_id, entry)
+    return entry
+
+
+def parse_range(range_header: str, size: int):
+    if not range_header or not range_header.startswith("bytes="):
+        return None
+    spec = range_header[len("bytes="):].strip()
+    if "," in spec:
+        return None
+    start, _, end = spec.partition("-")
+    try:
+        if not start:
+            length = int(end)
+            if length <= 0:
+                raise ValueError
+            return max(size - length, 0), size - 1
+        start = int(start)
+        end = int(end) if end else size - 1
+    except ValueError:
+        raise HTTPException(
+            status_code=416, detail="Некорректный диапазон.", headers={"Content-Range": f"bytes */{size}"}
+        )
+    if start >= size or end < start:
+        raise HTTPException(
+            status_code=416, detail="Некорректный диапазон.", headers={"Content-Range": f"bytes */{size}"}
+        )
+    return start, min(end, size - 1)
+
+
+class BookFileResponse(Response):
+    chunk_size = 64 * 1024
+    media_type = "application/pdf"
+
+    def __init__(self, book_file: BookFile, start: int, end: int, status_code: int, headers: dict):
+        super().__init__(status_code=status_code, headers=headers)
+        self.book_file = book_file
+        self.start = start
+        self.end = end
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"] == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        count = self.end - self.start + 1
+        async with await anyio.open_file(self.book_file.path, "rb") as f:
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": f.wrapped,
+                    "offset": self.start,
+                    "count": count,
+                    "more_body": False,
+                })
+                return
+            await f.seek(self.start)
+            while count > 0:
+                chunk = await f.read(min(self.chunk_size, count))
+                if not chunk:
+                    break
+                count -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        # завершающее пустое тело отправляем всегда: и для пустого файла, и если файл оказался короче
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def book_file_response(request: Request, book_file: BookFile, filename: str) -> Response:
+    headers = {
+        "ETag": book_file.etag,
+        "Last-Modified": http_date(book_file.mtime),
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, no-cache",
+    }
+    if_none_match = request.headers.get("if-none-match")
+    if etag_matches(if_none_match, book_file.etag) or (
+        not if_none_match and not_modified_since(request.headers.get("if-modified-since"), book_file.mtime)
+    ):
+        return Response(status_code=304, headers=headers)
+    headers["Content-Disposition"] = f'inline; filename="{filename}"'
+    byte_range = None
+    if_range = request.headers.get("if-range")
+    if not if_range or if_range == book_file.etag:
+        byte_range = parse_range(request.headers.get("range"), book_file.size)
+    if byte_range is None:
+        headers["Content-Length"] = str(book_file.size)
+        return BookFileResponse(book_file, 0, book_file.size - 1, 200, headers)
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{book_file.size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return BookFileResponse(book_file, start, end, 206, headers)
+
+
+def _relative_path(book_file: BookFile) -> str:
+    return quote(os.path.relpath(book_file.path, BOOKS_DIR).replace(os.sep, "/"))
+
+
+def sign_url(uri: str, expires: int) -> str:
+    # формат модуля ngx_http_secure_link_module: secure_link_md5 "$secure_link_expires$uri <secret>"
+    digest = hashlib.md5(f"{expires}{uri} {PDF_SIGNED_URL_SECRET}".encode()).digest()
+    return base64.urlsafe_b64encode(digest).decode().rstrip("=")
+
+
+def offload_response(book_file: BookFile, filename: str) -> Response:
+    headers = {
+        "Content-Type": "application/pdf",
+        "Content-Disposition": f'inline; filename="{filename}"',
+    }
+    if PDF_DELIVERY == "accel":
+        headers["X-Accel-Redirect"] = f"{PDF_ACCEL_PREFIX}/{_relative_path(book_file)}"
+        return Response(headers=headers)
+    if PDF_DELIVERY == "sendfile":
+        headers["X-Sendfile"] = os.path.abspath(book_file.path)
+        return Response(headers=headers)
+    if PDF_DELIVERY == "signed":
+        if not PDF_SIGNED_URL_SECRET:
+            raise HTTPException(status_code=500, detail="PDF_SIGNED_URL_SECRET не задан.")
+        url = f"{PDF_SIGNED_BASE_URL}/{_relative_path(book_file)}"
+        expires = int(time.time()) + PDF_SIGNED_URL_TTL
+        return RedirectResponse(
+            f"{url}?md5={sign_url(urlsplit(url).path, expires)}&expires={expires}",
+            status_code=307,
+            headers={"Cache-Control": "no-store"},
+        )
+    raise HTTPException(status_code=500, detail=f"Неизвестный режим PDF_DELIVERY: {PDF_DELIVERY}")
+
+
+def deliver_book_file(request: Request, book_file: BookFile, filename: str) -> Response:
+    # токен проверяет вызывающий эндпоинт одинаково для всех режимов, в ссылку на файл он не попадает
+    if PDF_DELIVERY == "app":
+        return book_file_response(request, book_file, filename)
+    return offload_response(book_file, filename)
@@ -0,0 +1,59 @@
+import os
+import time
+from collections import OrderedDict, namedtuple
+
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "30"))
+
+Principal = namedtuple("Principal", ["id", "username", "role"])
+
+
+class PrincipalCache:
+    def __init__(self, max_entries: int = PRINCIPAL_CACHE_SIZE, ttl: float = PRINCIPAL_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.generation = 0
+        self.entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, username: str):
+        entry = self.entries.get(username)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self.entries[username]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(username)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, principal: Principal, generation: int):
+        # пока читали пользователя из базы, его могли изменить или удалить
+        if generation != self.generation or self.ttl <= 0:
+            return
+        self.entries[principal.username] = (time.monotonic() + self.ttl, principal)
+        self.entries.move_to_end(principal.username)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, *usernames):
+        self.generation += 1
+        self.invalidations += 1
+        for username in usernames:
+            self.entries.pop(username, None)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "invalidations": self.invalidations,
+            "ttl": self.ttl,
+        }
+
+
+principal_cache = PrincipalCache()
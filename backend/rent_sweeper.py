@@ -0,0 +1,75 @@
+import asyncio
+import os
+from datetime import datetime
+from sqlalchemy import delete, select, tuple_, update
+from database import AsyncSessionLocal
+from models import Book, Rent, Request
+from dashboard_cache import dashboard_cache
+from endpontikis.chat import user_chat_manager
+
+RENT_SWEEP_INTERVAL = int(os.getenv("RENT_SWEEP_INTERVAL", "60"))
+RENT_SWEEP_BATCH = int(os.getenv("RENT_SWEEP_BATCH", "500"))
+
+
+class RentSweeper:
+    def __init__(self, interval: int = RENT_SWEEP_INTERVAL, batch_size: int = RENT_SWEEP_BATCH):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.task = None
+
+    async def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                print("Ошибка при снятии просроченных аренд:", e)
+            await asyncio.sleep(self.interval)
+
+    async def sweep(self):
+        while True:
+            released = await self.expire_batch()
+            for book_id, title in released:
+                await user_chat_manager.broadcast_book_available(book_id, title)
+            if not released:
+                break
+
+    async def expire_batch(self):
+        async with AsyncSessionLocal() as db:
+            rents = (await db.execute(
+                select(Rent.id, Rent.user_id, Rent.book_id)
+                .where(Rent.expires_at <= datetime.utcnow())
+                .order_by(Rent.expires_at)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            )).all()
+            if not rents:
+                return []
+            pairs = [(rent.user_id, rent.book_id) for rent in rents]
+            await db.execute(delete(Rent).where(Rent.id.in_([rent.id for rent in rents])))
+            await db.execute(
+                update(Request)
+                .where(tuple_(Request.user_id, Request.book_id).in_(pairs), Request.status == "approved")
+                .values(status="expired")
+            )
+            book_ids = {rent.book_id for rent in rents}
+            still_rented = set((await db.execute(
+                select(Rent.book_id).where(Rent.book_id.in_(list(book_ids))).distinct()
+            )).scalars().all())
+            released = (await db.execute(
+                select(Book.id, Book.title).where(Book.id.in_(list(book_ids - still_rented)))
+            )).all()
+            await db.commit()
+            dashboard_cache.invalidate(*(rent.user_id for rent in rents))
+            return released
+
+
+rent_sweeper = RentSweeper()
@@ -0,0 +1,152 @@
+import asyncio
+import json
+import os
+from datetime import datetime
+from typing import Dict
+from fastapi import HTTPException, WebSocket, status
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import or_, and_, bindparam, select
+from database import AsyncSessionLocal
+from models import Book, Request, User
+from pagination import decode_cursor, encode_cursor
+from chat_manager import ChatConnection
+from chat_pubsub import create_pubsub
+
+OPEN_STATUSES = ["pending", "return_requested"]
+SNAPSHOT_PAGE_SIZE = 50
+REQUEST_FEED_QUEUE = int(os.getenv("REQUEST_FEED_QUEUE", "256"))
+REQUEST_FEED_SEND_TIMEOUT = float(os.getenv("REQUEST_FEED_SEND_TIMEOUT", "10"))
+REQUEST_FEED_CHANNEL = os.getenv("REQUEST_FEED_CHANNEL", "request_events")
+# столько id заявок с запасом влезает в один NOTIFY
+REQUEST_FEED_EVENT_IDS = 500
+
+
+def request_row(req, user, book):
+    return {
+        "id": req.id,
+        "username": user.username,
+        "book_id": book.id,
+        "book_title": book.title,
+        "status": req.status,
+        "created_at": req.created_at
+    }
+
+
+def requests_query():
+    return select(Request, User, Book)\
+        .join(User, User.id == Request.user_id)\
+        .join(Book, Book.id == Request.book_id)
+
+
+def open_requests_query(limit: int = None, after: str = None):
+    # статусы уходят в SQL литералами: с параметрами планировщик не сопоставит запрос с частичным индексом
+    # ix_requests_open_created
+    statuses = bindparam("open_statuses", OPEN_STATUSES, expanding=True, literal_execute=True)
+    stmt = requests_query()\
+        .where(Request.status.in_(statuses))\
+        .order_by(Request.created_at, Request.id)
+    if after:
+        created_at, request_id = decode_cursor(after, 2)
+        try:
+            created_at = datetime.fromisoformat(created_at)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Некорректный курсор.")
+        stmt = stmt.where(or_(
+            Request.created_at > created_at,
+            and_(Request.created_at == created_at, Request.id > request_id)
+        ))
+    if limit:
+        stmt = stmt.limit(limit + 1)
+    return stmt
+
+
+async def open_requests_page(db, limit: int = None, after: str = None):
+    rows = (await db.execute(open_requests_query(limit, after))).all()
+    next_cursor = None
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1][0]
+        next_cursor = encode_cursor(last.created_at.isoformat(), last.id)
+    return [request_row(*row) for row in rows], next_cursor
+
+
+class RequestFeed:
+    # изменения заявок идут через тот же pub/sub, что и чат (CHAT_PUBSUB), только id:
+    # каждый воркер сам дочитывает заявки и рассылает их своим подключённым библиотекарям
+    def __init__(self, queue_size: int = REQUEST_FEED_QUEUE, send_timeout: float = REQUEST_FEED_SEND_TIMEOUT):
+        self.connections: Dict[WebSocket, ChatConnection] = {}
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        self.evicted = 0
+        self.closing = set()
+        self.pubsub = None
+
+    async def start(self, pubsub=None):
+        self.pubsub = pubsub or create_pubsub(channel=REQUEST_FEED_CHANNEL)
+        await self.pubsub.start(self.handle_event)
+
+    async def stop(self):
+        if self.pubsub:
+            await self.pubsub.stop()
+            self.pubsub = None
+        for websocket in list(self.connections):
+            self.disconnect(websocket)
+        await asyncio.gather(*self.closing, return_exceptions=True)
+
+    async def connect(self, websocket: WebSocket):
+        await websocket.accept()
+        # как в чате: своя очередь и свой писатель, зависший сокет не держит publish
+        conn = ChatConnection(self, None, websocket, self.queue_size)
+        self.connections[websocket] = conn
+        conn.start()
+
+    def disconnect(self, websocket: WebSocket):
+        conn = self.connections.pop(websocket, None)
+        if conn:
+            conn.stop()
+
+    def evict(self, conn: ChatConnection):
+        if self.connections.get(conn.websocket) is conn:
+            del self.connections[conn.websocket]
+            self.evicted += 1
+            task = asyncio.create_task(conn.close(status.WS_1008_POLICY_VIOLATION))
+            self.closing.add(task)
+            task.add_done_callback(self.closing.discard)
+
+    def send(self, websocket: WebSocket, message: dict):
+        conn = self.connections.get(websocket)
+        if conn and not conn.send(json.dumps(jsonable_encoder(message), ensure_ascii=False)):
+            self.evict(conn)
+
+    async def send_snapshot(self, websocket: WebSocket, after: str = None):
+        async with AsyncSessionLocal() as db:
+            items, next_cursor = await open_requests_page(db, SNAPSHOT_PAGE_SIZE, after)
+        self.send(websocket, {"type": "snapshot", "requests": items, "next_cursor": next_cursor})
+
+    async def handle_event(self, event: dict):
+        request_ids = event.get("request_ids")
+        if not self.connections or not request_ids:
+            return
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(requests_query().where(Request.id.in_(request_ids)))).all()
+        for row in rows:
+            message = {"type": "request", "request": request_row(*row)}
+            for websocket in list(self.connections):
+                self.send(websocket, message)
+
+    async def publish(self, request_ids):
+        request_ids = list(request_ids)
+        for start in range(0, len(request_ids), REQUEST_FEED_EVENT_IDS):
+            event = {"request_ids": request_ids[start:start + REQUEST_FEED_EVENT_IDS]}
+            if self.pubsub is None:
+                await self.handle_event(event)
+                continue
+            try:
+                await self.pubsub.publish(event)
+            except Exception as e:
+                # без pub/sub хотя бы библиотекари этого воркера увидят изменение
+                print("Ошибка публикации события ленты заявок:", e)
+                await self.handle_event(event)
+
+
+request_feed = RequestFeed()
@@ -0,0 +1,150 @@
+import asyncio
+import hashlib
+import os
+import secrets
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from sqlalchemy import delete
+from database import AsyncSessionLocal
+from models import PasswordResetToken
+
+RESET_TOKEN_STORE = os.getenv("RESET_TOKEN_STORE", "db")
+RESET_TOKEN_TTL = int(os.getenv("RESET_TOKEN_TTL", "3600"))
+RESET_TOKEN_SWEEP_INTERVAL = int(os.getenv("RESET_TOKEN_SWEEP_INTERVAL", "300"))
+
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class ResetTokenStore(ABC):
+    def __init__(self, ttl: int = RESET_TOKEN_TTL, sweep_interval: int = RESET_TOKEN_SWEEP_INTERVAL):
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.task = None
+
+    async def issue(self, user_id: int) -> str:
+        token = secrets.token_urlsafe(32)
+        await self.save(hash_token(token), user_id, datetime.utcnow() + timedelta(seconds=self.ttl))
+        return token
+
+    @abstractmethod
+    async def save(self, token_hash: str, user_id: int, expires_at: datetime):
+        ...
+
+    @abstractmethod
+    async def get(self, token: str):
+        ...
+
+    @abstractmethod
+    async def consume(self, token: str, db=None):
+        # с db токен гасится в транзакции вызывающего: после её commit вызывающий зовёт consumed(token)
+        ...
+
+    async def consumed(self, token: str):
+        pass
+
+    @abstractmethod
+    async def sweep(self) -> int:
+        ...
+
+    async def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                print("Ошибка при очистке токенов сброса пароля:", e)
+            await asyncio.sleep(self.sweep_interval)
+
+
+class MemoryResetTokenStore(ResetTokenStore):
+    # только для одного процесса: другой воркер uvicorn этих токенов не увидит
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tokens = {}
+
+    async def save(self, token_hash, user_id, expires_at):
+        self.tokens[token_hash] = (user_id, expires_at)
+
+    async def get(self, token):
+        entry = self.tokens.get(hash_token(token))
+        if entry is None or entry[1] <= datetime.utcnow():
+            return None
+        return entry[0]
+
+    async def consume(self, token, db=None):
+        # у словаря нет транзакции: с db токен только проверяется, а удаляется в consumed после commit
+        token_hash = hash_token(token)
+        entry = self.tokens.get(token_hash) if db is not None else self.tokens.pop(token_hash, None)
+        if entry is None or entry[1] <= datetime.utcnow():
+            return None
+        return entry[0]
+
+    async def consumed(self, token):
+        self.tokens.pop(hash_token(token), None)
+
+    async def sweep(self):
+        now = datetime.utcnow()
+        expired = [token_hash for token_hash, (_, expires_at) in self.tokens.items() if expires_at <= now]
+        for token_hash in expired:
+            del self.tokens[token_hash]
+        return len(expired)
+
+
+class DatabaseResetTokenStore(ResetTokenStore):
+    async def save(self, token_hash, user_id, expires_at):
+        async with AsyncSessionLocal() as db:
+            db.add(PasswordResetToken(token_hash=token_hash, user_id=user_id, expires_at=expires_at))
+            await db.commit()
+
+    async def get(self, token):
+        async with AsyncSessionLocal() as db:
+            row = await db.get(PasswordResetToken, hash_token(token))
+            if row is None or row.expires_at <= datetime.utcnow():
+                return None
+            return row.user_id
+
+    async def consume(self, token, db=None):
+        # DELETE ... RETURNING: из двух одновременных запросов токен получит только один
+        stmt = delete(PasswordResetToken).where(
+            PasswordResetToken.token_hash == hash_token(token),
+            PasswordResetToken.expires_at > datetime.utcnow(),
+        ).returning(PasswordResetToken.user_id)
+        if db is not None:
+            return (await db.execute(stmt)).scalar()
+        async with AsyncSessionLocal() as db:
+            user_id = (await db.execute(stmt)).scalar()
+            await db.commit()
+            return user_id
+
+    async def sweep(self):
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                delete(PasswordResetToken).where(PasswordResetToken.expires_at <= datetime.utcnow())
+            )
+            await db.commit()
+            return result.rowcount
+
+
+RESET_TOKEN_STORES = {
+    "memory": MemoryResetTokenStore,
+    "db": DatabaseResetTokenStore,
+}
+
+
+def create_reset_token_store(name: str = RESET_TOKEN_STORE) -> ResetTokenStore:
+    if name not in RESET_TOKEN_STORES:
+        raise ValueError(f"Неизвестное хранилище токенов сброса: {name}")
+    return RESET_TOKEN_STORES[name]()
+
+
+reset_token_store = create_reset_token_store()
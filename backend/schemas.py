@@ -1,4 +1,4 @@
-from pydantic import BaseModel, conint, constr
+from pydantic import BaseModel, conint, conlist, constr
 
 class UserIn(BaseModel):
     username: constr(min_length=3, max_length=12, pattern=r"^[a-zA-Z0-9_]+$")
@@ -55,6 +55,9 @@ class ProcessRequestIn(BaseModel):
     request_id: int
     approve: bool
 
+class ProcessRequestsBatchIn(BaseModel):
+    decisions: conlist(ProcessRequestIn, min_length=1, max_length=500)
+
 class ReturnRequestIn(BaseModel):
     request_id: int
     username: constr(min_length=3, max_length=12, pattern=r"^[a-zA-Z0-9_]+$")
@@ -67,3 +70,6 @@ class AcceptReturnIn(BaseModel):
 class CancelPendingRequestIn(BaseModel):
     request_id: int
     username: constr(min_length=3, max_length=12, pattern=r"^[a-zA-Z0-9_]+$")
+
+class AcceptReturnsBatchIn(BaseModel):
+    request_ids: conlist(int, min_length=1, max_length=500)
@@ -0,0 +1,154 @@
+import os
+import re
+from sqlalchemy import Float, Integer, bindparam, cast, false, func, literal_column, or_, text
+from sqlalchemy.dialects.postgresql import REGCONFIG
+from models import Book
+
+SEARCH_LANGUAGE = os.getenv("SEARCH_LANGUAGE", "russian")
+
+_token_re = re.compile(r"\w+", re.UNICODE)
+
+_PG_VECTOR = (
+    "setweight(to_tsvector(CAST(:lang AS regconfig), coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector(CAST(:lang AS regconfig), coalesce(author, '')), 'B') || "
+    "setweight(to_tsvector(CAST(:lang AS regconfig), coalesce(genre, '') || ' ' || coalesce(publisher, '')), 'C') || "
+    "setweight(to_tsvector(CAST(:lang AS regconfig), coalesce(description, '') || ' ' || coalesce(content_text, '')), 'D')"
+)
+
+_PG_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "ALTER TABLE books ADD COLUMN IF NOT EXISTS search_vector tsvector",
+    "CREATE INDEX IF NOT EXISTS ix_books_search_vector ON books USING gin (search_vector)",
+    "CREATE INDEX IF NOT EXISTS ix_books_title_trgm ON books USING gin (title gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_books_author_trgm ON books USING gin (author gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_books_genre_trgm ON books USING gin (genre gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_books_publisher_trgm ON books USING gin (publisher gin_trgm_ops)",
+]
+
+_SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5("
+    "title, author, genre, publisher, description, content, tokenize='unicode61 remove_diacritics 2')",
+]
+
+# веса bm25 идут в порядке колонок books_fts, как веса A/B/C/D в postgres
+_SQLITE_RANK = "bm25(books_fts, 10.0, 5.0, 2.0, 2.0, 1.0, 1.0)"
+
+
+def _dialect(bind):
+    return bind.dialect.name
+
+
+def _tokens(query: str):
+    return _token_re.findall(query.lower())
+
+
+async def init_search(conn):
+    if _dialect(conn) == "postgresql":
+        for stmt in _PG_DDL:
+            await conn.execute(text(stmt))
+        await conn.execute(
+            text(f"UPDATE books SET search_vector = {_PG_VECTOR} WHERE search_vector IS NULL"),
+            {"lang": SEARCH_LANGUAGE},
+        )
+    elif _dialect(conn) == "sqlite":
+        columns = [row[1] for row in (await conn.execute(text("PRAGMA table_info(books_fts)"))).all()]
+        if columns and "content" not in columns:
+            await conn.execute(text("DROP TABLE books_fts"))
+        for stmt in _SQLITE_DDL:
+            await conn.execute(text(stmt))
+        await conn.execute(text(
+            "INSERT INTO books_fts(rowid, title, author, genre, publisher, description, content) "
+            "SELECT id, title, author, genre, publisher, description, coalesce(content_text, '') FROM books "
+            "WHERE id NOT IN (SELECT rowid FROM books_fts)"
+        ))
+
+
+async def index_book(db, book, content_text: str = None):
+    if _dialect(db.bind) == "postgresql":
+        await db.execute(
+            text(f"UPDATE books SET search_vector = {_PG_VECTOR} WHERE id = :id"),
+            {"lang": SEARCH_LANGUAGE, "id": book.id},
+        )
+    elif _dialect(db.bind) == "sqlite":
+        await unindex_book(db, book.id)
+        await db.execute(
+            text(
+                "INSERT INTO books_fts(rowid, title, author, genre, publisher, description, content) "
+                "VALUES (:id, :title, :author, :genre, :publisher, :description, :content)"
+            ),
+            {
+                "id": book.id,
+                "title": book.title,
+                "author": book.author,
+                "genre": book.genre,
+                "publisher": book.publisher,
+                "description": book.description,
+                "content": content_text or "",
+            },
+        )
+
+
+async def index_books(db, book_ids):
+    if _dialect(db.bind) == "postgresql":
+        await db.execute(
+            text(f"UPDATE books SET search_vector = {_PG_VECTOR} WHERE id = ANY(:ids)"),
+            {"lang": SEARCH_LANGUAGE, "ids": list(book_ids)},
+        )
+    elif _dialect(db.bind) == "sqlite":
+        await db.execute(
+            text(
+                "INSERT INTO books_fts(rowid, title, author, genre, publisher, description, content) "
+                "SELECT id, title, author, genre, publisher, description, coalesce(content_text, '') FROM books "
+                "WHERE id IN :ids"
+            ).bindparams(bindparam("ids", expanding=True)),
+            {"ids": list(book_ids)},
+        )
+
+
+async def unindex_book(db, book_id: int):
+    if _dialect(db.bind) == "sqlite":
+        await db.execute(text("DELETE FROM books_fts WHERE rowid = :id"), {"id": book_id})
+
+
+def apply_search(stmt, db, query: str):
+    tokens = _tokens(query)
+    if not tokens:
+        return stmt.where(false()), literal_column("0", Float)
+    if _dialect(db.bind) == "postgresql":
+        tsquery = func.to_tsquery(
+            cast(SEARCH_LANGUAGE, REGCONFIG),
+            " & ".join(f"{t}:*" for t in tokens),
+        )
+        pattern = f"%{query}%"
+        rank = func.ts_rank_cd(Book.search_vector, tsquery) + func.similarity(Book.title, query)
+        stmt = stmt.where(
+            or_(
+                Book.search_vector.op("@@")(tsquery),
+                Book.title.ilike(pattern),
+                Book.author.ilike(pattern),
+                Book.genre.ilike(pattern),
+                Book.publisher.ilike(pattern),
+            )
+        )
+        return stmt, rank
+    if _dialect(db.bind) == "sqlite":
+        match = " ".join(f'"{t}"*' for t in tokens)
+        hits = (
+            text(f"SELECT rowid AS book_id, {_SQLITE_RANK} AS rank FROM books_fts WHERE books_fts MATCH :match")
+            .bindparams(match=match)
+            .columns(book_id=Integer, rank=Float)
+            .subquery("hits")
+        )
+        # bm25 возвращает меньшие значения для более релевантных строк
+        return stmt.join(hits, hits.c.book_id == Book.id), -hits.c.rank
+    pattern = f"%{query}%"
+    stmt = stmt.where(
+        or_(
+            Book.author.ilike(pattern),
+            Book.genre.ilike(pattern),
+            Book.publisher.ilike(pattern),
+            Book.title.ilike(pattern),
+            Book.description.ilike(pattern),
+        )
+    )
+    return stmt, literal_column("0", Float)
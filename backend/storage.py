@@ -0,0 +1,185 @@
+import asyncio
+import hashlib
+import os
+import threading
+from collections import namedtuple
+from contextlib import asynccontextmanager, contextmanager
+from uuid import uuid4
+from fastapi import HTTPException, UploadFile
+from sqlalchemy import select
+from starlette.concurrency import run_in_threadpool
+from models import Book
+
+try:
+    import fcntl
+except ImportError:  # windows: блокировка действует только внутри процесса
+    fcntl = None
+
+BOOKS_DIR = os.getenv("BOOKS_DIR", "books")
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+PDF_MAGIC = b"%PDF-"
+
+# tmp_path - жёсткая ссылка на тот же файл, живёт до коммита книги (см. settle_pdf)
+StoredFile = namedtuple("StoredFile", ["path", "sha256", "size", "tmp_path"])
+
+_local_lock = threading.Lock()
+
+
+def content_path(sha256: str) -> str:
+    return os.path.join(BOOKS_DIR, sha256[:2], f"{sha256}.pdf")
+
+
+def _fsync_dir(path: str):
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _acquire(sha256: str, blocking: bool = True):
+    # один файл делят все книги с тем же содержимым: проверка ссылок и удаление,
+    # как и выкладка нового файла, идут под блокировкой каталога, общей для всех воркеров
+    directory = os.path.dirname(content_path(sha256))
+    os.makedirs(directory, exist_ok=True)
+    if fcntl is None:
+        return _local_lock.release if _local_lock.acquire(blocking) else None
+    lock_file = open(os.path.join(directory, ".lock"), "a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    return lock_file.close
+
+
+@contextmanager
+def _content_locked(sha256: str):
+    release = _acquire(sha256)
+    try:
+        yield
+    finally:
+        release()
+
+
+@asynccontextmanager
+async def content_lock(sha256: str):
+    # ждём без потока из пула: пока блокировку держат, потоки пула могут быть заняты такими же ожидающими
+    while (release := _acquire(sha256, blocking=False)) is None:
+        await asyncio.sleep(0.01)
+    try:
+        yield
+    finally:
+        release()
+
+
+def _finish(f, tmp_path: str, sha256: str) -> str:
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+    final_path = content_path(sha256)
+    with _content_locked(sha256):
+        if not os.path.exists(final_path):
+            os.link(tmp_path, final_path)
+            _fsync_dir(os.path.dirname(final_path))
+    return final_path
+
+
+def _settle(stored: StoredFile):
+    with _content_locked(stored.sha256):
+        # пока книга не была закоммичена, удаление другой книги с тем же содержимым могло убрать файл
+        if not os.path.exists(stored.path):
+            os.replace(stored.tmp_path, stored.path)
+            _fsync_dir(os.path.dirname(stored.path))
+        else:
+            os.remove(stored.tmp_path)
+
+
+def _abort(f, tmp_path: str):
+    f.close()
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+
+def store_pdf_file(src) -> StoredFile:
+    tmp_dir = os.path.join(BOOKS_DIR, "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    tmp_path = os.path.join(tmp_dir, f"{uuid4().hex}.part")
+    f = open(tmp_path, "wb")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        while True:
+            chunk = src.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            if size == 0 and not chunk.startswith(PDF_MAGIC):
+                raise ValueError("файл не является PDF")
+            digest.update(chunk)
+            size += len(chunk)
+            f.write(chunk)
+        if size == 0:
+            raise ValueError("файл пустой")
+        sha256 = digest.hexdigest()
+        path = _finish(f, tmp_path, sha256)
+    except BaseException:
+        _abort(f, tmp_path)
+        raise
+    return StoredFile(path, sha256, size, tmp_path)
+
+
+async def store_pdf(upload: UploadFile) -> StoredFile:
+    tmp_dir = os.path.join(BOOKS_DIR, "tmp")
+    await run_in_threadpool(os.makedirs, tmp_dir, exist_ok=True)
+    tmp_path = os.path.join(tmp_dir, f"{uuid4().hex}.part")
+    f = await run_in_threadpool(open, tmp_path, "wb")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        while True:
+            chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            if size == 0 and not chunk.startswith(PDF_MAGIC):
+                raise HTTPException(status_code=400, detail="Пожалуйста, загрузите файл в формате PDF.")
+            digest.update(chunk)
+            size += len(chunk)
+            await run_in_threadpool(f.write, chunk)
+        if size == 0:
+            raise HTTPException(status_code=400, detail="Файл пустой.")
+        sha256 = digest.hexdigest()
+        path = await run_in_threadpool(_finish, f, tmp_path, sha256)
+    except BaseException:
+        await run_in_threadpool(_abort, f, tmp_path)
+        raise
+    return StoredFile(path, sha256, size, tmp_path)
+
+
+def remove_file(path: str):
+    if path and os.path.exists(path):
+        os.remove(path)
+
+
+async def settle_pdf(stored: StoredFile):
+    await run_in_threadpool(_settle, stored)
+
+
+async def release_pdf(db, sha256: str, path: str, thumbnail_path: str = None):
+    # вызывается после коммита, который убрал ссылку на файл
+    if not sha256:
+        await run_in_threadpool(remove_file, path)
+        await run_in_threadpool(remove_file, thumbnail_path)
+        return
+    async with content_lock(sha256):
+        shared = (await db.execute(select(Book.id).where(Book.pdf_sha256 == sha256).limit(1))).first()
+        if not shared:
+            remove_file(path)
+            remove_file(thumbnail_path)
+
+
+async def discard_pdf(db, stored: StoredFile):
+    # книга с файлом не закоммитилась: убираем наш экземпляр и общий файл, если он больше никому не нужен
+    await run_in_threadpool(remove_file, stored.tmp_path)
+    await release_pdf(db, stored.sha256, stored.path)
@@ -0,0 +1,47 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# database создаёт движок при импорте, поэтому одноразовая база задаётся до импорта модулей приложения:
+# временный SQLite или, если задан TEST_DATABASE_SERVER, отдельная база на этом сервере postgres
+from bench.scratch import scratch_database
+
+scratch_database(os.getenv("TEST_DATABASE_SERVER"))
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.environ.setdefault("CHAT_PUBSUB", "memory")
+
+import httpx
+import pytest
+from database import AsyncSessionLocal, init_db
+from models import User
+import auth
+
+
+@pytest.fixture(scope="session")
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(scope="session")
+async def db_ready(anyio_backend):
+    await init_db()
+
+
+@pytest.fixture
+async def client(db_ready):
+    from main import app
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as c:
+        yield c
+
+
+@pytest.fixture(scope="session")
+async def reader(db_ready):
+    async with AsyncSessionLocal() as db:
+        user = User(username="reader", password=auth.get_password_hash("Pass123!"), role="reader",
+                    email="reader@example.com")
+        db.add(user)
+        await db.commit()
+    return {"Authorization": f"Bearer {auth.create_access_token({'sub': 'reader'})}"}
@@ -0,0 +1,62 @@
+import asyncio
+import pytest
+from sqlalchemy import func, insert, select
+from auth import create_access_token
+from database import AsyncSessionLocal, engine
+from models import Book, Rent, Request, User
+
+pytestmark = pytest.mark.anyio
+
+BOOKS = 10
+READERS = 30
+
+
+@pytest.fixture
+async def pending_requests(db_ready):
+    if engine.dialect.name != "postgresql":
+        pytest.skip("SQLite игнорирует SELECT ... FOR UPDATE и пишет по одному, блокировки проверяются только на postgres")
+    async with AsyncSessionLocal() as db:
+        await db.execute(insert(User), [
+            {"username": "approvals_lib", "password": "-", "role": "librarian", "email": "approvals_lib@example.com"},
+            *[
+                {"username": f"approvals_{i}", "password": "-", "role": "reader", "email": f"approvals_{i}@example.com"}
+                for i in range(READERS)
+            ],
+        ])
+        user_ids = (await db.execute(
+            select(User.id).where(User.username.like("approvals\\_%", escape="\\"), User.role == "reader")
+        )).scalars().all()
+        book_ids = (await db.execute(
+            insert(Book).returning(Book.id),
+            [{"title": f"Книга {i}", "author": "-", "genre": "-", "publisher": "-", "description": "-"} for i in range(BOOKS)],
+        )).scalars().all()
+        request_ids = (await db.execute(
+            insert(Request).returning(Request.id),
+            [{"user_id": u, "book_id": b, "status": "pending"} for b in book_ids for u in user_ids],
+        )).scalars().all()
+        await db.commit()
+    return book_ids, request_ids
+
+
+async def test_parallel_approvals_rent_each_book_once(client, pending_requests):
+    book_ids, request_ids = pending_requests
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'approvals_lib'})}"}
+
+    async def approve(request_id):
+        response = await client.post("/process_request", json={"request_id": request_id, "approve": True}, headers=headers)
+        return response.status_code
+
+    statuses = await asyncio.gather(*(approve(request_id) for request_id in request_ids))
+    assert set(statuses) <= {200, 404, 409}
+    assert statuses.count(200) == BOOKS
+    async with AsyncSessionLocal() as db:
+        rents = dict((await db.execute(
+            select(Rent.book_id, func.count()).where(Rent.book_id.in_(book_ids)).group_by(Rent.book_id)
+        )).all())
+        approved = dict((await db.execute(
+            select(Request.book_id, func.count())
+            .where(Request.book_id.in_(book_ids), Request.status == "approved")
+            .group_by(Request.book_id)
+        )).all())
+    assert rents == {book_id: 1 for book_id in book_ids}
+    assert approved == {book_id: 1 for book_id in book_ids}
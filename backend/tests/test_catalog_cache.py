@@ -0,0 +1,43 @@
+import time
+import pytest
+from database import AsyncSessionLocal
+from models import Book
+from catalog_cache import catalog_cache
+
+pytestmark = pytest.mark.anyio
+
+AUTHOR = "Автор кэша каталога"
+
+
+async def add_book(title: str):
+    # запись мимо catalog_cache.bump(), как на другом воркере
+    async with AsyncSessionLocal() as db:
+        db.add(Book(title=title, author=AUTHOR))
+        await db.commit()
+
+
+async def test_other_worker_changes_visible_after_ttl(client, monkeypatch):
+    monkeypatch.setattr(catalog_cache, "ttl", 0.2)
+    await add_book("Первая")
+    params = {"author": AUTHOR, "fields": "title"}
+    response = await client.get("/books", params=params)
+    etag = response.headers["etag"]
+    assert [b["title"] for b in response.json()] == ["Первая"]
+
+    await add_book("Вторая")
+    response = await client.get("/books", params=params, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    time.sleep(0.25)
+    response = await client.get("/books", params=params, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    assert [b["title"] for b in response.json()] == ["Первая", "Вторая"]
+
+
+async def test_etag_survives_bump_when_content_is_same(client):
+    params = {"author": "Нет такого автора"}
+    etag = (await client.get("/books", params=params)).headers["etag"]
+    catalog_cache.bump()
+    response = await client.get("/books", params=params, headers={"If-None-Match": etag})
+    assert response.status_code == 304
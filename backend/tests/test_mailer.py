@@ -0,0 +1,103 @@
+import asyncio
+import re
+import socket
+from email import message_from_bytes
+import pytest
+from aiosmtpd.controller import Controller
+from mailer import Mailer, SMTPTransport
+from reset_tokens import reset_token_store
+import endpontikis.auth
+
+pytestmark = pytest.mark.anyio
+
+
+class Inbox:
+    # первые reject_first писем отвергаются временной ошибкой, как у перегруженного сервера
+    def __init__(self, reject_first: int = 0):
+        self.reject_first = reject_first
+        self.attempts = 0
+        self.messages = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.attempts += 1
+        if self.attempts <= self.reject_first:
+            return "451 Try again later"
+        self.messages.append(message_from_bytes(envelope.content))
+        return "250 OK"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_server():
+    servers = []
+
+    def start(inbox):
+        controller = Controller(inbox, hostname="127.0.0.1", port=free_port())
+        controller.start()
+        servers.append(controller)
+        return controller
+
+    yield start
+    for controller in servers:
+        controller.stop()
+
+
+@pytest.fixture
+async def mailer(smtp_server, monkeypatch):
+    monkeypatch.setenv("MAIL_FROM", "library@example.com")
+    started = []
+
+    async def start(inbox):
+        controller = smtp_server(inbox)
+        transport = SMTPTransport(controller.hostname, controller.port, user="", password="", starttls=False, timeout=5)
+        test_mailer = Mailer(transport, max_attempts=3, retry_delay=0.01, idle_timeout=5)
+        await test_mailer.start()
+        monkeypatch.setattr(endpontikis.auth, "mailer", test_mailer)
+        started.append(test_mailer)
+        return test_mailer
+
+    yield start
+    for test_mailer in started:
+        await test_mailer.stop()
+
+
+async def request_reset(client, test_mailer):
+    response = await client.post("/request_password_reset", json={"email": "reader@example.com"})
+    assert response.status_code == 200
+    await asyncio.wait_for(test_mailer.queue.join(), 10)
+
+
+async def test_reset_email_arrives(client, reader, mailer):
+    inbox = Inbox()
+    test_mailer = await mailer(inbox)
+    await request_reset(client, test_mailer)
+    assert test_mailer.sent == 1
+    [message] = inbox.messages
+    assert message["To"] == "reader@example.com"
+    assert message["From"] == "library@example.com"
+    token = re.search(r"/reset-password/(\S+)", message.get_payload(decode=True).decode()).group(1)
+    assert await reset_token_store.get(token) is not None
+
+
+async def test_reset_email_retried_after_temporary_failure(client, reader, mailer):
+    inbox = Inbox(reject_first=1)
+    test_mailer = await mailer(inbox)
+    await request_reset(client, test_mailer)
+    assert inbox.attempts == 2
+    assert len(inbox.messages) == 1
+    assert test_mailer.sent == 1
+    assert test_mailer.failed == 0
+
+
+async def test_reset_email_gives_up_after_max_attempts(client, reader, mailer):
+    inbox = Inbox(reject_first=10)
+    test_mailer = await mailer(inbox)
+    await request_reset(client, test_mailer)
+    assert inbox.attempts == test_mailer.max_attempts
+    assert inbox.messages == []
+    assert test_mailer.failed == 1
@@ -0,0 +1,97 @@
+import base64
+import hashlib
+import time
+from urllib.parse import parse_qs, urlsplit
+import pytest
+from database import AsyncSessionLocal
+from models import Book
+from pdf_delivery import book_file_cache
+import pdf_delivery
+
+pytestmark = pytest.mark.anyio
+
+PDF = b"%PDF-1.4 test book"
+
+
+@pytest.fixture
+async def book(tmp_path, monkeypatch, db_ready):
+    monkeypatch.setattr(pdf_delivery, "BOOKS_DIR", str(tmp_path))
+    path = tmp_path / "ab" / "abcdef.pdf"
+    path.parent.mkdir()
+    path.write_bytes(PDF)
+    async with AsyncSessionLocal() as db:
+        book = Book(title="Книга", pdf_path=str(path), pdf_size=len(PDF), pdf_sha256="abcdef")
+        db.add(book)
+        await db.commit()
+    yield book
+    book_file_cache.invalidate(book.id)
+
+
+@pytest.mark.parametrize("mode", ["app", "accel", "sendfile", "signed"])
+async def test_read_requires_token_in_every_mode(client, book, monkeypatch, mode):
+    monkeypatch.setattr(pdf_delivery, "PDF_DELIVERY", mode)
+    monkeypatch.setattr(pdf_delivery, "PDF_SIGNED_URL_SECRET", "s3cret")
+    response = await client.get(f"/read/{book.id}")
+    assert response.status_code == 401
+    response = await client.get(f"/read/{book.id}", headers={"Authorization": "Bearer garbage"})
+    assert response.status_code == 401
+
+
+async def test_accel_redirect(client, book, reader, monkeypatch):
+    monkeypatch.setattr(pdf_delivery, "PDF_DELIVERY", "accel")
+    response = await client.get(f"/read/{book.id}", headers=reader)
+    assert response.status_code == 200
+    assert response.headers["x-accel-redirect"] == "/protected-books/ab/abcdef.pdf"
+    assert response.content == b""
+
+
+async def test_signed_redirect(client, book, reader, monkeypatch):
+    secret = "s3cret"
+    monkeypatch.setattr(pdf_delivery, "PDF_DELIVERY", "signed")
+    monkeypatch.setattr(pdf_delivery, "PDF_SIGNED_URL_SECRET", secret)
+    response = await client.get(f"/read/{book.id}", headers=reader)
+    assert response.status_code == 307
+    assert response.content == b""
+    location = response.headers["location"]
+    token = reader["Authorization"].split()[1]
+    assert token not in location
+    url = urlsplit(location)
+    assert url.path == "/signed-books/ab/abcdef.pdf"
+    query = parse_qs(url.query)
+    assert set(query) == {"md5", "expires"}
+    expires = int(query["expires"][0])
+    assert expires > time.time()
+    # так же, как проверяет nginx: secure_link_md5 "$secure_link_expires$uri SECRET"
+    digest = hashlib.md5(f"{expires}{url.path} {secret}".encode()).digest()
+    assert query["md5"][0] == base64.urlsafe_b64encode(digest).decode().rstrip("=")
+
+
+async def test_app_serves_bytes(client, book, reader, monkeypatch):
+    monkeypatch.setattr(pdf_delivery, "PDF_DELIVERY", "app")
+    response = await client.get(f"/read/{book.id}", headers=reader)
+    assert response.status_code == 200
+    assert response.content == PDF
+
+
+async def test_empty_file_ends_body(book, tmp_path):
+    path = tmp_path / "empty.pdf"
+    path.write_bytes(b"")
+    book_file = pdf_delivery.BookFile(str(path), 0, '"empty"', path.stat().st_mtime)
+    response = pdf_delivery.BookFileResponse(book_file, 0, -1, 200, {"Content-Length": "0"})
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    await response({"type": "http", "method": "GET"}, None, send)
+    assert messages[-1] == {"type": "http.response.body", "body": b"", "more_body": False}
+
+
+async def test_cache_follows_file_on_disk(client, book, reader, monkeypatch):
+    monkeypatch.setattr(pdf_delivery, "PDF_DELIVERY", "app")
+    response = await client.get(f"/read/{book.id}", headers=reader)
+    assert response.content == PDF
+    with open(book.pdf_path, "wb") as f:
+        f.write(PDF + b" rewritten")
+    response = await client.get(f"/read/{book.id}", headers=reader)
+    assert response.content == PDF + b" rewritten"
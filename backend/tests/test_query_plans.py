@@ -0,0 +1,121 @@
+import json
+import random
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import insert, select, text
+from database import AsyncSessionLocal, engine
+from endpontikis.books import BOOK_FIELDS, catalog_query
+from models import Book, Comment, Rent, Request, User
+from pagination import encode_cursor
+from request_feed import open_requests_query
+from search import init_search
+
+pytestmark = pytest.mark.anyio
+
+# на маленьких таблицах планировщику дешевле seq scan, поэтому сначала сеем строки
+SEED_SIZE = 20000
+NOW = datetime(2026, 1, 1)
+FIELDS = list(BOOK_FIELDS)
+
+# запросы горячих эндпоинтов и таблица, которую каждый из них не должен сканировать целиком
+CHECKS = [
+    ("request_rent: активная заявка", "requests", lambda db: select(Request).where(
+        Request.user_id == 7, Request.book_id == 7, Request.status.in_(["pending", "approved"])
+    )),
+    ("request_rent / give_book: активная аренда", "rents", lambda db: select(Rent).where(
+        Rent.user_id == 7, Rent.book_id == 7, Rent.expires_at > NOW
+    )),
+    ("process_request: остальные pending заявки книги", "requests", lambda db: select(Request.id).where(
+        Request.book_id == 7, Request.status == "pending"
+    )),
+    ("get_requests: очередь библиотекаря", "requests", lambda db: open_requests_query(limit=50)),
+    ("accept_return: аренда пользователя", "rents", lambda db: select(Rent).where(
+        Rent.user_id == 7, Rent.book_id == 7
+    )),
+    ("get_comments: отзывы книги", "comments", lambda db: select(Comment).where(
+        Comment.book_id == 7
+    ).order_by(Comment.created_at.desc(), Comment.id.desc()).limit(20)),
+    ("my_requests: заявки пользователя", "requests", lambda db: select(Request).where(Request.user_id == 7)),
+    ("get_profile: аренды пользователя", "rents", lambda db: select(Rent).where(
+        Rent.user_id == 7, Rent.expires_at > NOW
+    )),
+    # каталог строится тем же catalog_query, что и в get_books
+    ("get_books: следующая страница", "books", lambda db: catalog_query(
+        db, FIELDS, limit=50, after=encode_cursor(SEED_SIZE // 2)
+    )[0]),
+    ("get_books: поиск", "books", lambda db: catalog_query(db, FIELDS, query="книга 123", limit=50)[0]),
+]
+
+# в sqlite ilike - это lower(...) LIKE, индекса под него нет; в postgres фильтры идут по триграммным индексам
+PG_CHECKS = [
+    ("get_books: фильтр по автору", "books", lambda db: catalog_query(db, FIELDS, author="Автор 42", limit=50)[0]),
+    ("get_books: поиск с фильтрами", "books", lambda db: catalog_query(
+        db, FIELDS, query="книга", genre="Жанр 3", publisher="Изд 7", limit=50
+    )[0]),
+]
+
+
+async def seed(conn, size: int):
+    rnd = random.Random(0)
+    users = [{"username": f"seed{i}", "password": "-", "role": "reader", "email": f"seed{i}@example.com"} for i in range(size)]
+    books = [
+        {"title": f"Книга {i}", "author": f"Автор {i % 500}", "genre": f"Жанр {i % 40}", "publisher": f"Изд {i % 90}",
+         "description": "-"}
+        for i in range(size)
+    ]
+    await conn.execute(insert(User), users)
+    user_ids = (await conn.execute(select(User.id))).scalars().all()
+    # только свои книги: у книг из других тестов уже могут быть аренды
+    book_ids = (await conn.execute(insert(Book).returning(Book.id), books)).scalars().all()
+    statuses = ["pending", "approved", "declined", "returned", "returned", "returned", "return_requested"]
+    await conn.execute(insert(Request), [
+        {"user_id": rnd.choice(user_ids), "book_id": rnd.choice(book_ids), "status": rnd.choice(statuses),
+         "created_at": NOW - timedelta(minutes=i)}
+        for i in range(size * 3)
+    ])
+    # у книги не больше одной аренды (уникальный индекс rents.book_id)
+    await conn.execute(insert(Rent), [
+        {"user_id": rnd.choice(user_ids), "book_id": book_id,
+         "rented_at": NOW - timedelta(hours=rnd.randint(0, 1000)), "expires_at": NOW + timedelta(hours=rnd.randint(-1000, 48))}
+        for book_id in rnd.sample(book_ids, size // 2)
+    ])
+    await conn.execute(insert(Comment), [
+        {"user_id": rnd.choice(user_ids), "book_id": rnd.choice(book_ids), "text": "-", "rating": rnd.randint(1, 5),
+         "created_at": NOW - timedelta(minutes=i)}
+        for i in range(size * 2)
+    ])
+    await init_search(conn)
+
+
+def _pg_seq_scans(plan, table):
+    found = plan.get("Node Type") == "Seq Scan" and plan.get("Relation Name") == table
+    return found or any(_pg_seq_scans(child, table) for child in plan.get("Plans", []))
+
+
+async def explain(conn, stmt, table):
+    compiled = stmt.compile(dialect=conn.dialect, compile_kwargs={"render_postcompile": True})
+    params = tuple(compiled.params[name] for name in compiled.positiontup)
+    if conn.dialect.name == "postgresql":
+        plan = (await conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", params)).scalar()
+        plan = json.loads(plan) if isinstance(plan, str) else plan
+        return _pg_seq_scans(plan[0]["Plan"], table), json.dumps(plan[0]["Plan"], ensure_ascii=False)
+    rows = (await conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params)).all()
+    details = [row[-1] for row in rows]
+    return any(d.startswith(f"SCAN {table}") and "INDEX" not in d for d in details), "; ".join(details)
+
+
+@pytest.fixture(scope="module")
+async def seeded(db_ready):
+    async with engine.begin() as conn:
+        await seed(conn, SEED_SIZE)
+        await conn.execute(text("ANALYZE"))
+
+
+@pytest.mark.parametrize("name, table, build", CHECKS + PG_CHECKS, ids=[c[0] for c in CHECKS + PG_CHECKS])
+async def test_no_seq_scan(seeded, name, table, build):
+    async with AsyncSessionLocal() as db:
+        conn = await db.connection()
+        if (name, table, build) in PG_CHECKS and conn.dialect.name != "postgresql":
+            pytest.skip("фильтры каталога по индексу только в postgres")
+        seq_scan, plan = await explain(conn, build(db), table)
+    assert not seq_scan, plan
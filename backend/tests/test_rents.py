@@ -0,0 +1,16 @@
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_reader_cannot_list_active_rents(client, reader):
+    response = await client.get("/active_rents", headers=reader)
+    assert response.status_code == 403
+    response = await client.get("/active_rents/export", headers=reader)
+    assert response.status_code == 403
+
+
+async def test_reader_sees_only_rented_book_ids(client, reader):
+    response = await client.get("/rented_books", headers=reader)
+    assert response.status_code == 200
+    assert set(response.json()) == {"book_ids", "my_book_ids"}
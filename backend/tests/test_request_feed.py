@@ -0,0 +1,57 @@
+import asyncio
+import pytest
+from chat_pubsub import PostgresPubSub
+from database import AsyncSessionLocal, engine
+from models import Book, Request, User
+from request_feed import RequestFeed
+
+pytestmark = pytest.mark.anyio
+
+
+class Librarian:
+    # вместо сокета: feed.send кладёт события сюда
+    def __init__(self, feed: RequestFeed):
+        self.events = asyncio.Queue()
+        feed.connections[self] = None
+        feed.send = lambda websocket, message: websocket.events.put_nowait(message)
+
+
+@pytest.fixture(scope="module")
+async def request_id(db_ready):
+    async with AsyncSessionLocal() as db:
+        user = User(username="feed_reader", password="-", role="reader", email="feed_reader@example.com")
+        book = Book(title="Книга для ленты")
+        db.add_all([user, book])
+        await db.flush()
+        req = Request(user_id=user.id, book_id=book.id, status="pending")
+        db.add(req)
+        await db.commit()
+    return req.id
+
+
+async def test_event_reaches_librarian_on_other_worker(request_id):
+    if engine.dialect.name != "postgresql":
+        pytest.skip("обмен между воркерами идёт через LISTEN/NOTIFY postgres")
+    channel = "test_request_events"
+    writer, reader = RequestFeed(), RequestFeed()
+    await writer.start(PostgresPubSub(channel=channel))
+    await reader.start(PostgresPubSub(channel=channel))
+    try:
+        librarian = Librarian(reader)
+        await writer.publish([request_id])
+        message = await asyncio.wait_for(librarian.events.get(), 5)
+    finally:
+        await writer.stop()
+        await reader.stop()
+    assert message["type"] == "request"
+    assert message["request"]["id"] == request_id
+    assert message["request"]["book_title"] == "Книга для ленты"
+
+
+async def test_event_delivered_locally_without_pubsub(request_id):
+    feed = RequestFeed()
+    librarian = Librarian(feed)
+    await feed.publish([request_id])
+    message = librarian.events.get_nowait()
+    assert message["request"]["id"] == request_id
+    assert message["request"]["status"] == "pending"
@@ -0,0 +1,78 @@
+import io
+import os
+import pytest
+from sqlalchemy import delete
+from database import AsyncSessionLocal
+from models import Book
+from storage import discard_pdf, release_pdf, settle_pdf, store_pdf_file
+import storage
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def books_dir(tmp_path, monkeypatch, db_ready):
+    monkeypatch.setattr(storage, "BOOKS_DIR", str(tmp_path))
+    return tmp_path
+
+
+def store(content: bytes):
+    return store_pdf_file(io.BytesIO(content))
+
+
+async def add_book(db, stored):
+    book = Book(title="Книга", pdf_path=stored.path, pdf_sha256=stored.sha256, pdf_size=stored.size)
+    db.add(book)
+    await db.commit()
+    await settle_pdf(stored)
+    return book
+
+
+async def delete_book(db, book):
+    await db.execute(delete(Book).where(Book.id == book.id))
+    await db.commit()
+    await release_pdf(db, book.pdf_sha256, book.pdf_path, book.thumbnail_path)
+
+
+async def test_shared_file_removed_with_last_book(books_dir):
+    content = b"%PDF-1.4 shared"
+    async with AsyncSessionLocal() as db:
+        first = await add_book(db, store(content))
+        second = await add_book(db, store(content))
+        assert first.pdf_path == second.pdf_path
+        await delete_book(db, first)
+        assert os.path.exists(second.pdf_path)
+        await delete_book(db, second)
+        assert not os.path.exists(second.pdf_path)
+    assert os.listdir(books_dir / "tmp") == []
+
+
+async def test_delete_during_upload_keeps_new_book_file(books_dir):
+    content = b"%PDF-1.4 racing"
+    async with AsyncSessionLocal() as db:
+        old = await add_book(db, store(content))
+        # файл уже выложен, а книга ещё не закоммичена: удаление старой книги не видит новую ссылку
+        stored = store(content)
+        await delete_book(db, old)
+        new = await add_book(db, stored)
+        with open(new.pdf_path, "rb") as f:
+            assert f.read() == content
+        await delete_book(db, new)
+    assert os.listdir(books_dir / "tmp") == []
+
+
+async def test_discard_after_failed_commit(books_dir):
+    async with AsyncSessionLocal() as db:
+        stored = store(b"%PDF-1.4 orphan")
+        await discard_pdf(db, stored)
+    assert not os.path.exists(stored.path)
+    assert not os.path.exists(stored.tmp_path)
+
+
+async def test_discard_keeps_file_of_committed_book(books_dir):
+    content = b"%PDF-1.4 kept"
+    async with AsyncSessionLocal() as db:
+        book = await add_book(db, store(content))
+        await discard_pdf(db, store(content))
+        assert os.path.exists(book.pdf_path)
+        await delete_book(db, book)
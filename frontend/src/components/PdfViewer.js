@@ -3,7 +3,7 @@ import '@react-pdf-viewer/core/lib/styles/index.css';
 import '@react-pdf-viewer/default-layout/lib/styles/index.css';
 import Box from "@mui/material/Box";
 
-function PdfViewer({ pdfUrl }) {
+function PdfViewer({ pdfUrl, token }) {
   return (
     <Box
       sx={{
@@ -17,7 +17,7 @@ function PdfViewer({ pdfUrl }) {
       }}
     >
       <Worker workerUrl={`https://unpkg.com/pdfjs-dist@3.11.174/build/pdf.worker.min.js`}>
-        <Viewer fileUrl={pdfUrl} />
+        <Viewer fileUrl={pdfUrl} httpHeaders={{ Authorization: `Bearer ${token || ""}` }} />
       </Worker>
     </Box>
   );
@@ -31,7 +31,7 @@ function AdminPanel() {
 
   useEffect(() => {
     if (useUserStore.getState().username) {
-      ws.current = new window.WebSocket(`ws://localhost:8000/ws/chat/${useUserStore.getState().username}`);
+      ws.current = new window.WebSocket(`ws://localhost:8000/ws/chat/${encodeURIComponent(useUserStore.getState().username)}?token=${encodeURIComponent(useUserStore.getState().token)}`);
       ws.current.onmessage = (event) => {
         const data = JSON.parse(event.data);
         if (data.type === "book_available") {
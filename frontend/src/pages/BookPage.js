@@ -51,7 +51,7 @@ function BookPage() {
     });
 
     if (username) {
-      ws.current = new window.WebSocket(`ws://localhost:8000/ws/chat/${username}`);
+      ws.current = new window.WebSocket(`ws://localhost:8000/ws/chat/${encodeURIComponent(username)}?token=${encodeURIComponent(token)}`);
       ws.current.onmessage = (event) => {
         const data = JSON.parse(event.data);
         if (data.type === "book_available") {
@@ -83,9 +83,7 @@ function BookPage() {
   }
   if (!book) return <div>Загрузка...</div>;
 
-  const avgRating = comments.length
-    ? (comments.reduce((sum, c) => sum + (c.rating || 0), 0) / comments.length).toFixed(2)
-    : null;
+  const avgRating = book.rating_avg != null ? book.rating_avg.toFixed(2) : null;
 
   const handleRent = async () => {
     if (!username) {
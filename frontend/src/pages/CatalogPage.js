@@ -16,7 +16,7 @@ function CatalogPage() {
   useAuthRedirect();
 
   const [books, setBooks] = useState([]);
-  const [activeRents, setActiveRents] = useState([]);
+  const [rentedBooks, setRentedBooks] = useState({ book_ids: [], my_book_ids: [] });
   const [search, setSearch] = useState("");
   const [snackbarOpen, setSnackbarOpen] = useState(false);
   const [snackbarMsg, setSnackbarMsg] = useState("");
@@ -43,13 +43,13 @@ function CatalogPage() {
 
   useEffect(() => {
     fetchBooks();
-    fetch("http://localhost:8000/active_rents", {
+    fetch("http://localhost:8000/rented_books", {
       headers: {
         Authorization: `Bearer ${token || ""}`
       }
     })
       .then((res) => res.json())
-      .then(setActiveRents);
+      .then(setRentedBooks);
   }, [fetchBooks, token]);
 
   useEffect(() => {
@@ -61,7 +61,7 @@ function CatalogPage() {
       navigate("/", { replace: true });
       return;
     }
-    ws.current = new window.WebSocket(`ws://localhost:8000/ws/chat/${username}`);
+    ws.current = new window.WebSocket(`ws://localhost:8000/ws/chat/${encodeURIComponent(username)}?token=${encodeURIComponent(token)}`);
     ws.current.onmessage = (event) => {
       const data = JSON.parse(event.data);
       if (data.type === "book_available") {
@@ -69,13 +69,13 @@ function CatalogPage() {
         setSnackbarSeverity("info");
         setSnackbarOpen(true);
         fetchBooks();
-        fetch("http://localhost:8000/active_rents", {
+        fetch("http://localhost:8000/rented_books", {
           headers: {
             Authorization: `Bearer ${token || ""}`
           }
         })
           .then((res) => res.json())
-          .then(setActiveRents);
+          .then(setRentedBooks);
       }
     };
     return () => {
@@ -88,8 +88,8 @@ function CatalogPage() {
     return null;
   }
 
-  const rentedBookIds = activeRents.map((r) => r.book_id);
-  const myRentedBookIds = activeRents.filter(r => r.username === username).map(r => r.book_id);
+  const rentedBookIds = rentedBooks.book_ids;
+  const myRentedBookIds = rentedBooks.my_book_ids;
 
   return (
     <Container
@@ -18,6 +18,7 @@ function getChatHistoryKey(username) {
 
 function ChatPage() {
   const username = useUserStore((s) => s.username);
+  const token = useUserStore((s) => s.token);
   const [users, setUsers] = useState([]);
   const [selectedUser, setSelectedUser] = useState("");
   const [messages, setMessages] = useState({});
@@ -64,11 +65,20 @@ function ChatPage() {
       navigate("/", { replace: true });
       return;
     }
-    ws.current = new WebSocket(`ws://localhost:8000/ws/chat/${username}`);
+    ws.current = new WebSocket(
+      `ws://localhost:8000/ws/chat/${encodeURIComponent(username)}?token=${encodeURIComponent(token)}`
+    );
     ws.current.onmessage = (event) => {
       const data = JSON.parse(event.data);
       if (data.type === "users") {
         setUsers([...new Set(data.users.filter((u) => u && u !== username))]);
+      } else if (data.type === "presence") {
+        setUsers((prev) => {
+          const next = new Set(prev);
+          data.left.forEach((u) => next.delete(u));
+          data.joined.forEach((u) => u && u !== username && next.add(u));
+          return [...next];
+        });
       } else if (data.type === "message") {
         setMessages((prev) => {
           const from = data.from;
@@ -125,12 +135,16 @@ function ChatPage() {
         setSnackbarMsg(`Книга "${data.book_title}" теперь доступна для аренды!`);
         setSnackbarSeverity("info");
         setSnackbarOpen(true);
+      } else if (data.type === "error") {
+        setSnackbarMsg(data.detail);
+        setSnackbarSeverity("error");
+        setSnackbarOpen(true);
       }
     };
     return () => {
       ws.current && ws.current.close();
     };
-  }, [username, navigate, fetchMyBooks]);
+  }, [username, token, navigate, fetchMyBooks]);
 
   const sendMessage = () => {
     if (!selectedUser || !input.trim()) return;
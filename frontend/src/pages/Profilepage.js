@@ -24,13 +24,14 @@ function Profilepage() {
   const [newPassword, setNewPassword] = useState("");
   const [loading, setLoading] = useState(true);
   const username = useUserStore((s) => s.username);
+  const token = useUserStore((s) => s.token);
   const navigate = useNavigate();
   const ws = useRef(null);
   const setSnackbar = useUserStore((s) => s.setSnackbar);
 
   useEffect(() => {
     fetchRequests();
-    ws.current = new window.WebSocket(`ws://localhost:8000/ws/chat/${username}`);
+    ws.current = new window.WebSocket(`ws://localhost:8000/ws/chat/${encodeURIComponent(username)}?token=${encodeURIComponent(token)}`);
     ws.current.onmessage = (event) => {
       const data = JSON.parse(event.data);
       if (data.type === "book_available") {
@@ -46,7 +47,7 @@ function Profilepage() {
       ws.current && ws.current.close();
     };
     // eslint-disable-next-line
-  }, [username, navigate]);
+  }, [username, token, navigate]);
 
   function fetchRequests() {
     setLoading(true);
@@ -17,7 +17,7 @@ function ReadPage() {
     return null;
   }
 
-  const pdfUrl = `http://localhost:8000/read/${bookId}?token=${token || ""}`;
+  const pdfUrl = `http://localhost:8000/read/${bookId}`;
 
   return (
     <Box
@@ -43,7 +43,7 @@ function ReadPage() {
           <Typography variant="h5" color="primary" sx={{ mb: 2 }}>
             📖 Чтение книги
           </Typography>
-          <PdfViewer pdfUrl={pdfUrl} />
+          <PdfViewer pdfUrl={pdfUrl} token={token} />
         </CardContent>
       </Card>
     </Box>